@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# TxAntennaDAB.csv gives each transmitter's horizontal radiation pattern as 36 columns, '0'
+# to '350', one every 10 degrees. Each value is the attenuation in dB below the peak
+# direction (the smallest value in every row is 0). Here the 36 columns are packed into one
+# contiguous float32 (N x 36) array so pattern maths runs over all transmitters at once.
+pattern_bearings = np.arange(0, 360, 10)
+pattern_columns = [str(bearing) for bearing in pattern_bearings]
+pattern_step = 10.0
+
+class ErpPatterns:
+    def __init__(self, ids, attenuation_db, peak_erp_kw):
+        self.ids = np.asarray(ids)
+        self.attenuation_db = np.ascontiguousarray(attenuation_db, dtype=np.float32)
+        self.peak_erp_kw = np.asarray(peak_erp_kw, dtype=np.float32)
+        # Read-only, so the same arrays can be shared safely between frames
+        for array in (self.ids, self.attenuation_db, self.peak_erp_kw):
+            array.flags.writeable = False
+        self._positions = None
+
+    # The pattern columns of a cleaned (or raw antenna) frame, with Power (kW) as the ERP in
+    # the peak direction
+    @classmethod
+    def from_frame(cls, df):
+        attenuation = df.reindex(columns=pattern_columns).to_numpy(dtype=np.float32)
+        power_column = 'Power (kW)' if 'Power (kW)' in df else 'In-Use ERP Total'
+        peak_erp = pd.to_numeric(df[power_column], errors='coerce') if power_column in df else np.nan
+        peak_erp = np.broadcast_to(np.asarray(peak_erp, dtype=np.float32), (len(df),))
+        return cls(df['id'].to_numpy(), attenuation, peak_erp)
+
+    # pandas copies frame attrs on most operations, the arrays are read-only so there is no
+    # need for those copies to duplicate them
+    def __deepcopy__(self, memo):
+        return self
+
+    def __len__(self):
+        return len(self.ids)
+
+    # The rows for the given transmitter ids, in that order, e.g. to line up with a filtered frame
+    def for_ids(self, ids):
+        if self._positions is None:
+            self._positions = pd.Index(self.ids)
+        positions = self._positions.get_indexer(np.asarray(ids))
+        if (positions < 0).any():
+            raise KeyError("Some ids have no antenna pattern")
+        return ErpPatterns(self.ids[positions], self.attenuation_db[positions], self.peak_erp_kw[positions])
+
+    # Attenuation in dB at a bearing in degrees, linearly interpolated between the 10 degree
+    # samples and wrapping round at 360. bearing is one value for every transmitter or an
+    # array with one bearing per transmitter.
+    def attenuation_at(self, bearing):
+        bearing = np.mod(np.broadcast_to(np.asarray(bearing, dtype=np.float64), (len(self),)), 360.0)
+        # A NaN bearing (e.g. the peak of a transmitter with no pattern) gives NaN
+        missing = np.isnan(bearing)
+        bearing = np.where(missing, 0.0, bearing)
+        lower = np.floor(bearing / pattern_step).astype(np.intp) % len(pattern_bearings)
+        upper = (lower + 1) % len(pattern_bearings)
+        fraction = (bearing - lower * pattern_step) / pattern_step
+        rows = np.arange(len(self))
+        attenuation = self.attenuation_db[rows, lower] * (1 - fraction) + self.attenuation_db[rows, upper] * fraction
+        return np.where(missing, np.nan, attenuation)
+
+    # ERP in kW towards a bearing
+    def erp_at(self, bearing):
+        return self.peak_erp_kw * np.power(10.0, -self.attenuation_at(bearing) / 10.0)
+
+    # Bearing of the strongest sample for every transmitter, NaN where there is no pattern
+    def peak_bearing(self):
+        has_pattern = ~np.isnan(self.attenuation_db).all(axis=1)
+        filled = np.where(np.isnan(self.attenuation_db), np.inf, self.attenuation_db)
+        return np.where(has_pattern, pattern_bearings[np.argmin(filled, axis=1)], np.nan)
+
+    # How many dB weaker the signal is directly behind the peak direction than at the peak
+    def front_to_back_ratio(self):
+        peak = self.peak_bearing()
+        return self.attenuation_at(peak + 180.0) - self.attenuation_at(peak)
+
+    # The ERP averaged over the full horizontal circle, in kW. Only the horizontal pattern is
+    # published so this is the azimuth average rather than a full 3D integration.
+    def total_radiated_power(self):
+        relative_power = np.power(10.0, -self.attenuation_db.astype(np.float64) / 10.0)
+        return self.peak_erp_kw * relative_power.mean(axis=1)
+
+# The patterns for a cleaned frame, lined up with its rows. clean_data attaches them to the
+# frame's attrs; for a frame without them (e.g. loaded from JSON) they are built from the columns.
+def erp_patterns(df):
+    patterns = df.attrs.get('erp_patterns')
+    if patterns is None:
+        return ErpPatterns.from_frame(df)
+    if len(patterns) == len(df) and np.array_equal(patterns.ids, df['id'].to_numpy()):
+        return patterns
+    return patterns.for_ids(df['id'])
@@ -1,6 +1,6 @@
 import pandas as pd
 import pymongo
-from pymongo import MongoClient
+from database import get_collection, find_multiplex_documents
 import json
 from statistics import mode
 import tkinter as tk
@@ -59,10 +59,7 @@ def clean_data(file_path):
     #Given how large the dataset is currently, and the complexity of our querying needs
     #I am going to now move this from a JSON file into mongoDB, it's also very efficient comparatively 
     #I have created a local version of this database instead of a cloud version
-    client = MongoClient("mongodb://localhost:27017/") 
-
-    db = client['dab_database']  # Use or create a database called 'dab_database'
-    collection = db['dab_data']  # Use or create a collection called 'dab_data'
+    collection = get_collection()  # Shared client from database.py, 'dab_database'/'dab_data'
 
     collection.insert_many(merged_data.to_dict('records'))
 
@@ -131,32 +128,12 @@ def printStats(merged_data):
         json.dump(stats_results, file, indent=4)
 
 def visualize_multiplex_data():
-    # we need to connect to the database as we will be querying it for the multiplexes.
-    client = MongoClient("mongodb://localhost:27017/") 
-    db = client['dab_database']
-    collection = db['dab_data']
-    
-    # Query data for the relevant multiplexes: C18A, C18F, C188
-
-    query = {"Multiplex": {"$in": multiplexes}}
-    
+    # Query data for the relevant multiplexes: C18A, C18F, C188, through the shared client
     # Retrieve the necessary fields as per the client requirement.
-    fields = {
-        "Site": 1, 
-        "Freq": 1,
-        "Block": 1,
-        "Serv Label1": 1,
-        "Serv Label2": 1,
-        "Serv Label3": 1,
-        "Serv Label4": 1,
-        "Serv Label10": 1,
-        "Multiplex": 1
-    }
-    
-    data = collection.find(query, fields)
+    fields = ["Site", "Freq", "Block", "Serv Label1", "Serv Label2", "Serv Label3",
+              "Serv Label4", "Serv Label10", "Multiplex"]
     
-    # Convert MongoDB cursor to pandas DataFrame
-    df = pd.DataFrame(list(data))
+    df = find_multiplex_documents(multiplexes, fields)
     
     # Drop rows with missing multiplex or service labels to avoid errors.
     df.dropna(subset=["Multiplex"], inplace=True)
@@ -378,7 +355,8 @@ printStats(cleaned_data)
 visualize_multiplex_data()
 analyze_correlation(cleaned_data)"""
 
-# Running the GUI Application
-root = tk.Tk()
-app = DABDataGUI(root)
-root.mainloop()
\ No newline at end of file
+# Running the GUI Application, only when run directly so importing this file doesn't open a window
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = DABDataGUI(root)
+    root.mainloop()
\ No newline at end of file
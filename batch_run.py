@@ -0,0 +1,153 @@
+import argparse
+import contextlib
+import json
+import math
+import numbers
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+# Off-screen rendering: this has to happen before anything imports pyplot. Worker processes
+# run this module's top level again (or inherit it when forked) so they render off-screen too.
+import matplotlib
+matplotlib.use("Agg")
+
+# Headless batch run for nightly jobs on machines without a display:
+#   clean -> stats -> visualisation -> correlation
+# Every figure is rendered to files by a pool of worker processes instead of being shown,
+# and a machine-readable run summary is printed and written to the output directory.
+# Exit code is 0 when every stage succeeded and 1 otherwise.
+#
+#   python batch_run.py --antenna TxAntennaDAB.csv --params TxParamsDAB.csv --output-dir figures
+
+# Fields the multiplex figures use, the same ones visualize_multiplex_data fetches
+multiplex_fields = ["id", "Site", "Freq", "Block", "Serv Label1", "Serv Label2", "Serv Label3",
+                    "Serv Label4", "Serv Label10", "Multiplex"]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the DAB pipeline end to end without a display.")
+    parser.add_argument("--antenna", default="TxAntennaDAB.csv", help="Antenna CSV file")
+    parser.add_argument("--params", default="TxParamsDAB.csv", help="Params CSV file")
+    parser.add_argument("--output-dir", default="batch_output", help="Where figures and the run summary go")
+    parser.add_argument("--formats", nargs="+", default=["png"], choices=["png", "svg"], help="Figure formats")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Rendering worker processes")
+    parser.add_argument("--no-mongo", action="store_true",
+                        help="Don't write to MongoDB and take the multiplex figures from the cleaned data instead")
+    return parser.parse_args(argv)
+
+# Runs in a worker process: draws one figure and saves it in every requested format
+def render_figure(name, data, output_dir, formats):
+    import matplotlib.pyplot as plt
+    from visualization import multiplex_figures
+    from correlation_analysis import build_correlation_heatmap
+
+    if name == "correlation_heatmap":
+        figure = build_correlation_heatmap(data)
+    else:
+        figure = multiplex_figures[name](data)
+
+    paths = []
+    for file_format in formats:
+        path = os.path.join(output_dir, f"{name}.{file_format}")
+        figure.savefig(path, format=file_format, bbox_inches="tight")
+        paths.append(path)
+    plt.close(figure)
+    return paths
+
+# Missing statistics come out as NaN, which isn't valid JSON, so they are written as null
+def json_safe(value):
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral) and not math.isfinite(value):
+        return None
+    return value
+
+def run_stage(summary, name, func):
+    start = time.perf_counter()
+    try:
+        result = func()
+        summary["stages"][name] = {"status": "ok", "seconds": round(time.perf_counter() - start, 3)}
+        return result
+    except Exception as e:
+        summary["stages"][name] = {
+            "status": "failed",
+            "seconds": round(time.perf_counter() - start, 3),
+            "error": f"{type(e).__name__}: {e}",
+            "traceback": traceback.format_exc(),
+        }
+        return None
+
+def run(args):
+    from data_processing import clean_data, multiplexes
+    from statistics_handler import printStats
+    from correlation_analysis import preprocess_data, calculate_correlation
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary = {"stages": {}, "figures": {}, "statistics": None}
+    file_path = {"Antenna": args.antenna, "Params": args.params}
+
+    cleaned_data = run_stage(summary, "clean", lambda: clean_data(
+        file_path, output_path=os.path.join(args.output_dir, "merged_data.arrow"), use_mongo=not args.no_mongo,
+        report_path=os.path.join(args.output_dir, "pipeline_run_report.json")))
+    if cleaned_data is not None:
+        summary["rows"] = len(cleaned_data)
+        summary["clean_stages"] = {stage["stage"]: stage["wall_seconds"]
+                                   for stage in cleaned_data.attrs["run_report"]["stages"]}
+        summary["statistics"] = run_stage(summary, "stats", lambda: printStats(
+            cleaned_data, os.path.join(args.output_dir, "numerical_statistics_for_power.json")))
+
+        def multiplex_data():
+            if args.no_mongo:
+                # The params file pads the service label headers with a trailing space
+                df = cleaned_data[cleaned_data['Multiplex'].isin(multiplexes)].rename(columns=str.strip)
+                df = df.reindex(columns=multiplex_fields)
+                return df.dropna(subset=["Multiplex"])
+            from visualization import fetch_multiplex_data
+            return fetch_multiplex_data()
+
+        figure_data = {}
+        visual_data = run_stage(summary, "visualisation_data", multiplex_data)
+        if visual_data is not None:
+            from visualization import multiplex_figures
+            for name in multiplex_figures:
+                figure_data[name] = visual_data
+
+        correlation_matrix = run_stage(summary, "correlation",
+                                       lambda: calculate_correlation(preprocess_data(cleaned_data)))
+        if correlation_matrix is not None:
+            figure_data["correlation_heatmap"] = correlation_matrix
+
+        def render_all():
+            with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+                futures = {name: executor.submit(render_figure, name, data, args.output_dir, args.formats)
+                           for name, data in figure_data.items()}
+                failures = []
+                for name, future in futures.items():
+                    try:
+                        summary["figures"][name] = {"status": "ok", "files": future.result()}
+                    except Exception as e:
+                        summary["figures"][name] = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+                        failures.append(name)
+                if failures:
+                    raise RuntimeError(f"Failed to render: {', '.join(failures)}")
+
+        run_stage(summary, "render", render_all)
+
+    summary["success"] = all(stage["status"] == "ok" for stage in summary["stages"].values())
+    with open(os.path.join(args.output_dir, "run_summary.json"), "w") as file:
+        json.dump(json_safe(summary), file, indent=4, default=str, allow_nan=False)
+    return summary
+
+def main(argv=None):
+    # stdout is kept for the machine-readable summary, printStats' console lines go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        summary = run(parse_args(argv))
+    print(json.dumps(json_safe(summary), default=str, allow_nan=False))
+    return 0 if summary["success"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use("Agg")
+
+# Times and memory-profiles each pipeline stage on synthetic datasets of growing size (see
+# generate_dab_data.py) and appends the results to a JSON lines file, one record per stage
+# and size, tagged with the commit. Comparing against the last record for the same stage and
+# size flags regressions between commits.
+#
+#   python benchmark.py --sizes 1000 10000 100000
+#   python benchmark.py --sizes 1000 --mongo      (also times the upsert into a scratch collection)
+#
+# Wall time is the best of --repeat untraced runs; peak memory comes from one more run under
+# tracemalloc, which slows things down too much to time at the same time.
+
+default_sizes = [1000, 10000, 100000]
+benchmark_collection = "dab_benchmark"
+# A stage counts as a regression when it is this much slower than the last recorded run
+regression_ratio = 1.25
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DAB pipeline stages on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes, help="Dataset sizes in rows")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage")
+    parser.add_argument("--data-dir", default=".benchmark_data", help="Where generated datasets are kept")
+    parser.add_argument("--results", default="benchmark_results.jsonl", help="JSON lines file results are appended to")
+    parser.add_argument("--mongo", action="store_true", help="Also benchmark the MongoDB load")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated datasets")
+    return parser.parse_args(argv)
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Generated datasets are reused between runs, keyed by size and seed
+def dataset_for(size, data_dir, seed):
+    from generate_dab_data import generate_dataset
+    directory = os.path.abspath(os.path.join(data_dir, f"{size}_rows_seed{seed}"))
+    antenna_path = os.path.join(directory, "TxAntennaDAB.csv")
+    params_path = os.path.join(directory, "TxParamsDAB.csv")
+    if not (os.path.exists(antenna_path) and os.path.exists(params_path)):
+        generate_dataset(size, directory, seed)
+    return {"Antenna": antenna_path, "Params": params_path}
+
+def measure(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, min(timings), peak
+
+# The stages in pipeline order, each as a name and a function of the cleaned frame (None for
+# clean_data itself). Everything writes into work_dir so nothing in the repo is overwritten.
+def pipeline_stages(file_path, work_dir, use_mongo):
+    import matplotlib.pyplot as plt
+    from data_processing import clean_data
+    from statistics_handler import printStats
+    from correlation_analysis import analyze_correlation
+
+    def correlation(df):
+        analyze_correlation(df)
+        plt.close("all")
+
+    stages = [
+        ("clean_data", lambda df: clean_data(file_path, output_path=os.path.join(work_dir, "merged_data.arrow"),
+                                             use_mongo=False)),
+        ("printStats", printStats),
+        ("analyze_correlation", correlation),
+    ]
+    if use_mongo:
+        stages.append(("mongo_load", mongo_load))
+    return stages
+
+# Upserts into a scratch collection that is emptied first, so every run times a full load
+def mongo_load(df):
+    from database import get_client, mongo_settings
+    from data_processing import upsert_documents, default_batch_size
+    collection = get_client()[mongo_settings["database"]][benchmark_collection]
+    collection.drop()
+    return upsert_documents(collection, df.to_dict("records"), default_batch_size)
+
+def benchmark_size(size, args, commit):
+    file_path = dataset_for(size, args.data_dir, args.seed)
+    work_dir = os.path.abspath(os.path.join(args.data_dir, "work"))
+    os.makedirs(work_dir, exist_ok=True)
+    records = []
+    merged_data = None
+    cwd = os.getcwd()
+    # printStats writes its JSON into the working directory
+    os.chdir(work_dir)
+    try:
+        for name, stage in pipeline_stages(file_path, work_dir, args.mongo):
+            with contextlib.redirect_stdout(sys.stderr):
+                result, seconds, peak = measure(lambda: stage(merged_data), args.repeat)
+            if name == "clean_data":
+                merged_data = result
+            records.append({
+                "commit": commit,
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "stage": name,
+                "rows": size,
+                "cleaned_rows": len(merged_data),
+                "seconds": round(seconds, 4),
+                "rows_per_second": round(size / seconds) if seconds else None,
+                "peak_memory_mb": round(peak / 2**20, 2),
+            })
+    finally:
+        os.chdir(cwd)
+    return records
+
+def previous_results(path):
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as results_file:
+            for line in results_file:
+                if line.strip():
+                    record = json.loads(line)
+                    previous[(record["stage"], record["rows"])] = record
+    return previous
+
+def run(args):
+    commit = current_commit()
+    previous = previous_results(args.results)
+    regressions = []
+    with open(args.results, "a") as results_file:
+        for size in args.sizes:
+            for record in benchmark_size(size, args, commit):
+                results_file.write(json.dumps(record) + "\n")
+                results_file.flush()
+                before = previous.get((record["stage"], record["rows"]))
+                change = ""
+                if before and before["seconds"]:
+                    ratio = record["seconds"] / before["seconds"]
+                    change = f" ({ratio:.2f}x vs {before['commit']})"
+                    if ratio > regression_ratio:
+                        regressions.append(record)
+                print(f"{record['stage']:<20} {size:>10} rows  {record['seconds']:>9.3f}s  "
+                      f"{record['peak_memory_mb']:>9.1f} MB peak{change}")
+    return regressions
+
+if __name__ == "__main__":
+    regressions = run(parse_args())
+    if regressions:
+        print(f"{len(regressions)} stage(s) more than {regression_ratio}x slower than the last recorded run")
+    sys.exit(1 if regressions else 0)
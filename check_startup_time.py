@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+# Start-up budget for the GUI: how long a fresh interpreter may take to import main_gui,
+# which is everything that runs before the window can appear, and which heavy libraries
+# must not be imported by then. Run this after changing imports; it exits with 1 when
+# either check fails, so it can also gate a CI job.
+import_time_budget_seconds = 0.25
+deferred_modules = ['pandas', 'numpy', 'pymongo', 'pyarrow', 'matplotlib', 'seaborn']
+runs = 5
+
+_measure_script = """
+import sys, time
+start = time.perf_counter()
+import main_gui
+elapsed = time.perf_counter() - start
+loaded = [name for name in {modules!r} if name in sys.modules]
+print(elapsed)
+print(",".join(loaded))
+"""
+
+def measure_import_time():
+    script = _measure_script.format(modules=deferred_modules)
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout.split("\n")
+        timings.append(float(output[0]))
+        loaded.update(name for name in output[1].split(",") if name)
+    # The best of a few runs, so a busy machine doesn't fail the check by itself
+    return min(timings), sorted(loaded)
+
+if __name__ == "__main__":
+    best_time, loaded = measure_import_time()
+    print(f"Importing main_gui took {best_time:.3f}s (budget {import_time_budget_seconds:.3f}s)")
+    failed = False
+    if best_time > import_time_budget_seconds:
+        print("FAIL: start-up import time is over budget")
+        failed = True
+    if loaded:
+        print(f"FAIL: heavy modules imported at start-up: {', '.join(loaded)}")
+        failed = True
+    sys.exit(1 if failed else 0)
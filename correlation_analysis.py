@@ -1,49 +1,147 @@
+import re
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+# Columns in the original heatmap
+heatmap_columns = ['Freq', 'Block', 'Serv Label1', 'Serv Label2', 'Serv Label3', 'Serv Label4', 'Serv Label10']
+
+# Numeric fields that can go into the correlation next to the service label presence columns
+numeric_correlation_columns = ['Freq', 'Block', 'Site Height', 'Power (kW)']
+
+# 'Serv Label1' to 'Serv Label32' and 'Data Serv Label1' to 'Data Serv Label15'
+service_label_pattern = re.compile(r'^(Data )?Serv Label\d+$')
+
+def service_label_columns(df):
+    return [column for column in df.columns.str.strip() if service_label_pattern.match(column)]
+
+# Every column the correlation engine supports that this frame has
+def all_correlation_columns(df):
+    stripped = set(df.columns.str.strip())
+    return [column for column in numeric_correlation_columns if column in stripped] + service_label_columns(df)
+
 # Function to preprocess and clean the data for correlation analysis
 def preprocess_data(df):
-    # Ensure that 'Freq' and 'Block' are numeric. If they aren't, convert them.
-    df['Freq'] = pd.to_numeric(df['Freq'], errors='coerce')
-    df['Block'] = pd.to_numeric(df['Block'], errors='coerce')
+    # Work on a copy so the caller's frame (e.g. the GUI's cleaned data) is left as it was
+    df = df.copy()
      # Remove any leading or trailing spaces from column names as this was casuing errors.
     df.columns = df.columns.str.strip() 
 
-    # Encode service labels as binary (1 for non-null, 0 for null)
-    service_labels = ['Serv Label1', 'Serv Label2', 'Serv Label3', 'Serv Label4', 'Serv Label10']
-    
-    for label in service_labels:
+    # Ensure the numeric fields are numeric. If they aren't, convert them.
+    for column in numeric_correlation_columns:
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+
+    # Encode every service and data service label as binary (1 for non-null, 0 for null)
+    for label in service_label_columns(df):
         df[label] = df[label].notna().astype(int)  # 1 if label is present, 0 if not
 
     return df
 
+# Incremental Pearson correlation. Rather than keeping the rows, this keeps running sums per
+# pair of columns: how many rows had both values, the sum and sum of squares of each column
+# over those rows, and the sum of cross products. A new chunk or snapshot is added with a
+# few matrix products, O(rows x columns^2), and accumulators from separate chunks merge by
+# adding their sums. Missing values are left out pairwise, the same as pandas .corr().
+class CorrelationAccumulator:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.pair_counts = np.zeros((size, size))
+        # pair_sums[i, j] is the sum of column i over the rows where column j is present too
+        self.pair_sums = np.zeros((size, size))
+        self.pair_squares = np.zeros((size, size))
+        self.cross_products = np.zeros((size, size))
+        # Values are shifted by this before summing, which keeps the sums small for columns
+        # like Freq and so avoids losing precision. Correlation doesn't change with a shift.
+        self.shift = None
+
+    # Adds a preprocessed chunk (see preprocess_data)
+    def update(self, df):
+        values = df.reindex(columns=self.columns).to_numpy(dtype=float)
+        present = (~np.isnan(values)).astype(float)
+        if self.shift is None:
+            # The mean of the first chunk, or 0 for a column that has no values yet
+            column_counts = present.sum(axis=0)
+            self.shift = np.nansum(values, axis=0) / np.maximum(column_counts, 1)
+
+        shifted = np.where(present > 0, values - self.shift, 0.0)
+        self.pair_counts += present.T @ present
+        self.pair_sums += shifted.T @ present
+        self.pair_squares += (shifted * shifted).T @ present
+        self.cross_products += shifted.T @ shifted
+        return self
+
+    def merge(self, other):
+        if other.shift is None:
+            return self
+        if self.shift is None:
+            self.shift = np.zeros(len(self.columns))
+        # Re-express the other accumulator's sums around this one's shift
+        difference = other.shift - self.shift
+        other_sums = other.pair_sums + difference[:, None] * other.pair_counts
+        other_squares = other.pair_squares + 2 * difference[:, None] * other.pair_sums \
+            + (difference ** 2)[:, None] * other.pair_counts
+        other_cross = other.cross_products + difference[:, None] * other.pair_sums.T \
+            + other.pair_sums * difference[None, :] + np.outer(difference, difference) * other.pair_counts
+        self.pair_counts += other.pair_counts
+        self.pair_sums += other_sums
+        self.pair_squares += other_squares
+        self.cross_products += other_cross
+        return self
+
+    def correlation(self):
+        counts = self.pair_counts
+        sums = self.pair_sums
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = counts * self.cross_products - sums * sums.T
+            variance_i = counts * self.pair_squares - sums ** 2
+            variance_j = variance_i.T
+            matrix = covariance / np.sqrt(variance_i * variance_j)
+        # Constant or empty columns have no correlation, pandas gives NaN for these too
+        matrix[(variance_i <= 0) | (variance_j <= 0) | (counts < 2)] = np.nan
+        matrix = np.clip(matrix, -1.0, 1.0)
+        return pd.DataFrame(matrix, index=self.columns, columns=self.columns)
+
+# Builds an accumulator over a stream of raw chunks, e.g. from stream_clean_data
+def accumulate_correlation(chunks, columns=None, accumulator=None):
+    for chunk in chunks:
+        processed = preprocess_data(chunk)
+        if accumulator is None:
+            accumulator = CorrelationAccumulator(columns or all_correlation_columns(processed))
+        accumulator.update(processed)
+    return accumulator
+
 # Function to calculate and display correlation matrix
-def calculate_correlation(df):
-    # Selecting relevant columns for correlation
-    cols = ['Freq', 'Block'] + ['Serv Label1', 'Serv Label2', 'Serv Label3', 'Serv Label4', 'Serv Label10']
-    
-    # Calculate the correlation matrix
-    correlation_matrix = df[cols].corr()
+def calculate_correlation(df, cols=heatmap_columns):
+    # Calculate the correlation matrix for the selected columns
+    correlation_matrix = CorrelationAccumulator(cols).update(df).correlation()
 
     return correlation_matrix
 
 # Function to plot correlation matrix heatmap
 def plot_correlation_heatmap(correlation_matrix):
+    build_correlation_heatmap(correlation_matrix)
+    plt.show()
+
+# Draws the heatmap on a new figure and returns it without showing it, so it can also be
+# saved to a file off-screen
+def build_correlation_heatmap(correlation_matrix):
     plt.figure(figsize=(10, 8))
     sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', fmt='.2f', linewidths=0.5)
     plt.title("Correlation Heatmap of Frequency, Block, and Service Labels")
     #It is worth noting that Block will be empty here, Block returns 12B throughout
     #The entire dataset, and so in my opinion is slightly pointless here to even pot.
-    plt.show()
+    return plt.gcf()
 
 # Function to analyze correlation between columns
-def analyze_correlation(df):
+def analyze_correlation(df, cols=heatmap_columns):
     # Preprocess the data (convert service labels and Freq/Block to numeric if necessary)
     df_processed = preprocess_data(df)
     
     # Calculate the correlation matrix
-    correlation_matrix = calculate_correlation(df_processed)
+    correlation_matrix = calculate_correlation(df_processed, cols)
     
     # Visualize the correlation using a heatmap
     plot_correlation_heatmap(correlation_matrix)
\ No newline at end of file
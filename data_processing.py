@@ -1,34 +1,143 @@
 import pandas as pd
-from pymongo import MongoClient
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure
+import hashlib
 import json
 from statistics import mode
+from data_storage import save_prepared_data
+from database import get_collection
+from antenna_pattern import ErpPatterns
+from service_index import ServiceIndex
+from frame_compaction import compact_frame, print_memory_report
+from pipeline_metrics import PipelineRun, default_report_path
+from value_parsing import (multiplex_from_eid, indicator_columns, parse_numbers, parse_dates, parse_power_kw,
+                           record_rejected, merge_rejected, print_rejected_values)
 
 #Defining here for simplicity and re-usability
 multiplexes = ['C18A', 'C18F', 'C188']
 
-def clean_data(file_path):
-    data1 = pd.read_csv(file_path["Antenna"])
+# Task 1 - these NGRs must never appear in any output
+exclude_these_values = ['NZ02553847', 'SE213515', 'NT05399374', 'NT252675908']
+
+# Bump this whenever the cleaning steps change, so cached results from older code are not reused
+pipeline_version = 4
+
+# Default number of rows read from each CSV at a time when streaming
+default_chunksize = 50000
+
+# Default number of documents sent to MongoDB in one bulk write
+default_batch_size = 1000
+
+# progress, if given, is called as progress(stage, fraction) as each stage starts, e.g. by the
+# GUI's background task runner to drive its progress bar and to cancel the run. Every stage is
+# timed through pipeline_metrics.PipelineRun; hooks are called with each finished stage's
+# metrics and the whole run is written to report_path as JSON (None to skip the file).
+# trace_memory=True adds each stage's Python allocation peak from tracemalloc, for profiling.
+def clean_data(file_path, output_path="merged_data.arrow", batch_size=default_batch_size, progress=None,
+               use_mongo=True, hooks=(), report_path=default_report_path, trace_memory=False):
+    run = PipelineRun("clean_data", progress, hooks, trace_memory)
+    try:
+        merged_data = _run_clean_stages(run, file_path, output_path, batch_size, use_mongo)
+    except BaseException as error:
+        run.finish(type(error).__name__, report_path)
+        raise
+    report = run.finish("completed", report_path, rows=len(merged_data),
+                        memory_report=merged_data.attrs.get('memory_report'),
+                        rejected_values=merged_data.attrs.get('rejected_values'))
+    merged_data.attrs['run_report'] = report
+    run.progress("Done", 1.0)
+    return merged_data
+
+def _run_clean_stages(run, file_path, output_path, batch_size, use_mongo):
+    with run.stage("Reading antenna CSV", 0.0) as stage:
+        data1 = pd.read_csv(file_path["Antenna"], dtype=hex_column_dtypes(file_path["Antenna"]))
+        stage["rows"] = len(data1)
     #having to use Latin1 for encoding as when I initially read the .csv file from utf-8 I was 
     #getting an error
-    data2 = pd.read_csv(file_path["Params"], encoding='latin1')
+    with run.stage("Reading params CSV", 0.15) as stage:
+        data2 = pd.read_csv(file_path["Params"], encoding='latin1',
+                            dtype=hex_column_dtypes(file_path["Params"], 'latin1'))
+        stage["rows"] = len(data2)
 
     #merging on the first ID column as they share the same ID
-    merged_data = pd.merge(data1, data2, on='id', how='outer')
+    with run.stage("Merging", 0.3) as stage:
+        merged_data = pd.merge(data1, data2, on='id', how='outer')
+        stage["rows"] = len(merged_data)
+    del data1, data2
+
+    with run.stage("Filtering sites", 0.35) as stage:
+        merged_data = filter_excluded_sites(merged_data)
+        stage["rows"] = len(merged_data)
 
+    with run.stage("Parsing and deriving columns", 0.4) as stage:
+        merged_data = derive_columns(merged_data)
+        print_rejected_values(merged_data.attrs['rejected_values'])
+        stage["rows"] = len(merged_data)
+
+    with run.stage("Building indexes", 0.42) as stage:
+        merged_data = attach_indexes(merged_data)
+        stage["rows"] = len(merged_data)
+
+    #The cleaned frame is mostly repeated strings, so shrink it before it is saved and handed
+    #to the stats, plots and GUI
+    with run.stage("Compacting", 0.45) as stage:
+        merged_data, memory_report = compact_frame(merged_data, multiplexes)
+        merged_data.attrs['memory_report'] = memory_report
+        print_memory_report(memory_report)
+        stage["rows"] = len(merged_data)
+
+    #saving merged data to the columnar Arrow cache, it is typed and much faster to reload
+    #than the indented JSON. Passing a .json output_path still gives the old JSON export.
+    with run.stage("Saving prepared data", 0.5) as stage:
+        save_prepared_data(merged_data, output_path)
+        stage["rows"] = len(merged_data)
+
+    #Given how large the dataset is currently, and the complexity of our querying needs
+    #I am going to now move this from a JSON file into mongoDB, it's also very efficient comparatively 
+    #I have created a local version of this database instead of a cloud version,
+    #the shared client in database.py points at 'dab_database'/'dab_data' on localhost by default
+
+    #Upserting on the transmitter id rather than inserting, so re-running on the same
+    #snapshot doesn't keep adding copies of every document
+    if use_mongo:
+        with run.stage("Writing to MongoDB", 0.6) as stage:
+            collection = get_collection()
+            upsert_documents(collection, merged_data.to_dict('records'), batch_size,
+                             progress=lambda fraction: run.progress("Writing to MongoDB", 0.6 + 0.4 * fraction))
+            stage["rows"] = len(merged_data)
+
+    return merged_data
+
+# Applies all the cleaning steps to an already merged frame, compaction included, so the
+# streaming ingest below stores the same documents as clean_data. This works the same on the
+# whole dataset or on one chunk of it, which is what lets the streaming ingest reuse it.
+def clean_merged_frame(merged_data):
+    merged_data = attach_indexes(derive_columns(filter_excluded_sites(merged_data)))
+    merged_data, memory_report = compact_frame(merged_data, multiplexes)
+    merged_data.attrs['memory_report'] = memory_report
+    return merged_data
+
+def filter_excluded_sites(merged_data):
     #Changing 'Freq.' to 'Freq' as the former was causing issues.
     merged_data.rename(columns={"Freq.": "Freq"}, inplace=True)
     # Task 1
-    exclude_these_values = ['NZ02553847', 'SE213515', 'NT05399374', 'NT252675908']
-    merged_data = merged_data[~merged_data['NGR'].isin(exclude_these_values)]
+    return merged_data[~merged_data['NGR'].isin(exclude_these_values)].copy()
+
+# All the text fields are parsed a whole column at a time (see value_parsing.py). Values that
+# don't parse become NaN, are counted per column and shown together at the end, and are kept
+# in attrs['rejected_values'].
+def derive_columns(merged_data):
+    rejected = {}
 
     # Task 2
     # Extract the multiplex block (C18A, C18F, C188) from the 'EID' column
-    merged_data['Multiplex'] = merged_data['EID'].apply(lambda x: x[:4] if isinstance(x, str) else None)
+    multiplex, bad_eids = multiplex_from_eid(merged_data['EID'])
+    record_rejected(rejected, 'EID', merged_data['EID'], bad_eids)
+    merged_data['Multiplex'] = multiplex
 
     # Create a new column for each multiplex category
-    
-    for multiplex in multiplexes:
-        merged_data[multiplex] = merged_data['Multiplex'].apply(lambda x: 'Yes' if x == multiplex else 'No')
+    for multiplex_name, indicator in indicator_columns(merged_data['Multiplex'], multiplexes).items():
+        merged_data[multiplex_name] = indicator
 
     # Rename 'In-Use Ae Ht' and 'In-Use ERP Total' to 'Aerial height (m)' and 'Power (kW)' as per request
     merged_data['Aerial height (m)'] = merged_data['In-Use Ae Ht']
@@ -37,28 +146,204 @@ def clean_data(file_path):
     # Drop the old columns as these are no longer needed. 
     merged_data.drop(['In-Use Ae Ht', 'In-Use ERP Total'], axis=1, inplace=True)
 
+    for column in ('Site Height', 'Aerial height (m)'):
+        heights, bad_heights = parse_numbers(merged_data[column])
+        record_rejected(rejected, column, merged_data[column], bad_heights)
+        merged_data[column] = heights
+
     # Task 3 - HUGE TASK
-    # Convert 'Date' column to datetime to filter by year
-    # Extracting the year using string slicing, I am also saving it to a new column
-    #so that it is easier to compare and use that Year instead of the full date.
-    #I am also filling in any NaN values with 1900 just to reduce errors
-    merged_data['Year'] = merged_data['Date'].str[-4:].fillna('1900').astype(int)  
-    #I was having issues with power being treated as an int due to th ecomma delimeter, I just removed hte comma
-    #and put it as a number here so 1.018,472 would convert to 1.018472 for example
-    merged_data['Power (kW)'] = merged_data['Power (kW)'].str.replace(',', '').apply(pd.to_numeric, errors='coerce')
-
-    #saving merged data JSON instead of an XML as XML is too verbose for this
-    #I am also using lines=True as the dataset is relatively large so for readability
-    merged_data.to_json("merged_data.json", orient='records', lines=False, indent=4)
+    # The Date column is parsed as a real dd/mm/yyyy date and the year is taken from that,
+    #I am also filling in any missing or invalid dates with 1900 just to reduce errors
+    dates, bad_dates = parse_dates(merged_data['Date'])
+    record_rejected(rejected, 'Date', merged_data['Date'], bad_dates)
+    merged_data['Year'] = dates.dt.year.fillna(1900).astype(int)
+    #ERP is written in watts with a thousands dot and a decimal comma, e.g. "1.018,472" is
+    #1018.472 W, which is 1.018472 kW
+    power, bad_power = parse_power_kw(merged_data['Power (kW)'])
+    record_rejected(rejected, 'Power (kW)', merged_data['Power (kW)'], bad_power)
+    merged_data['Power (kW)'] = power
 
-    #Given how large the dataset is currently, and the complexity of our querying needs
-    #I am going to now move this from a JSON file into mongoDB, it's also very efficient comparatively 
-    #I have created a local version of this database instead of a cloud version
-    client = MongoClient("mongodb://localhost:27017/") 
+    merged_data.attrs['rejected_values'] = rejected
+    return merged_data
+
+# The packed antenna patterns and the service index, kept in attrs next to the rows
+def attach_indexes(merged_data):
+    # Pack the 36 antenna pattern columns into one float32 array for the pattern analytics in
+    # antenna_pattern.py; erp_patterns(df) gives them back lined up with the rows
+    merged_data.attrs['erp_patterns'] = ErpPatterns.from_frame(merged_data)
+    # Long (transmitter, service) table with an inverted index from service to sites, see
+    # service_index.py
+    merged_data.attrs['service_index'] = ServiceIndex.from_frame(merged_data)
+
+    return merged_data
+
+# Reads one of the input CSVs in chunks. Date and ERP are always read as strings so a chunk
+# where they happen to be all empty still goes through the .str cleaning steps. The hex service
+# ids are read as strings too: a chunk where they happen to be all digits would otherwise come
+# back as numbers and be stored differently from the same row cleaned by clean_data.
+def read_csv_chunks(path, chunksize=default_chunksize, encoding=None):
+    dtype = hex_column_dtypes(path, encoding)
+    dtype.update({'Date': object, 'In-Use ERP Total': object})
+    return pd.read_csv(path, chunksize=chunksize, encoding=encoding, dtype=dtype)
+
+# The hex service id columns are always text, whatever the values in them look like
+def hex_column_dtypes(path, encoding=None):
+    header = pd.read_csv(path, nrows=0, encoding=encoding).columns
+    return {column: str for column in header if column.endswith('(Hex)')}
+
+# Outer joins two chunked frames on 'id' without ever holding either file in full.
+# Both Ofcom files are published sorted by id, so this is a sorted merge join: we only
+# join rows up to the smallest "last id seen" of the sides that still have data, and
+# carry anything after that over to the next round.
+def merge_sorted_chunks(antenna_chunks, params_chunks, antenna_template, params_template):
+    sides = [
+        {"chunks": iter(antenna_chunks), "buffer": antenna_template, "done": False, "last_id": None},
+        {"chunks": iter(params_chunks), "buffer": params_template, "done": False, "last_id": None},
+    ]
+
+    while True:
+        for side in sides:
+            if not side["done"] and side["buffer"].empty:
+                chunk = next(side["chunks"], None)
+                if chunk is None:
+                    side["done"] = True
+                    continue
+                ids = chunk['id']
+                if not ids.is_monotonic_increasing or \
+                        (side["last_id"] is not None and len(ids) and ids.iloc[0] <= side["last_id"]):
+                    raise ValueError("Streaming ingest needs both CSV files sorted by a unique 'id'")
+                if len(ids):
+                    side["last_id"] = ids.iloc[-1]
+                side["buffer"] = chunk
+
+        if all(side["done"] and side["buffer"].empty for side in sides):
+            return
+
+        # Anything at or below the boundary can't have a partner in a later chunk
+        open_ends = [side["buffer"]['id'].iloc[-1] for side in sides if not side["done"] and not side["buffer"].empty]
+        boundary = min(open_ends) if open_ends else None
+
+        ready = []
+        for side in sides:
+            buffer = side["buffer"]
+            if boundary is None:
+                ready.append(buffer)
+                side["buffer"] = buffer.iloc[0:0]
+            else:
+                mask = buffer['id'] <= boundary
+                ready.append(buffer[mask])
+                side["buffer"] = buffer[~mask]
+
+        merged_chunk = pd.merge(ready[0], ready[1], on='id', how='outer')
+        if not merged_chunk.empty:
+            yield merged_chunk
+
+# Streaming version of clean_data. Each cleaned chunk is written to the JSON file and to
+# MongoDB as soon as it is ready and then yielded, so a caller such as printStats can
+# consume the output while the ingest is still running. Peak memory is bounded by the
+# chunk size rather than the size of the input files.
+def stream_clean_data(file_path, chunksize=default_chunksize, json_path="merged_data.json", use_mongo=True,
+                      batch_size=default_batch_size):
+    antenna_template = pd.read_csv(file_path["Antenna"], nrows=0)
+    params_template = pd.read_csv(file_path["Params"], nrows=0, encoding='latin1')
+    antenna_chunks = read_csv_chunks(file_path["Antenna"], chunksize)
+    params_chunks = read_csv_chunks(file_path["Params"], chunksize, encoding='latin1')
+
+    collection = None
+    if use_mongo:
+        collection = get_collection()
+
+    json_file = open(json_path, "w") if json_path else None
+    try:
+        if json_file:
+            json_file.write("[")
+        first_chunk = True
+        rejected = {}
+        for merged_chunk in merge_sorted_chunks(antenna_chunks, params_chunks, antenna_template, params_template):
+            cleaned_chunk = clean_merged_frame(merged_chunk)
+            merge_rejected(rejected, cleaned_chunk.attrs.get('rejected_values', {}))
+            if cleaned_chunk.empty:
+                continue
+
+            if json_file:
+                # Strip the outer brackets so the chunks join up into one JSON array
+                records = cleaned_chunk.to_json(orient='records', indent=4).strip()[1:-1].rstrip()
+                json_file.write(records if first_chunk else "," + records)
+            if collection is not None:
+                upsert_documents(collection, cleaned_chunk.to_dict('records'), batch_size)
+            first_chunk = False
+
+            yield cleaned_chunk
+        if json_file:
+            json_file.write("\n]")
+        print_rejected_values(rejected)
+    finally:
+        if json_file:
+            json_file.close()
+
+# Runs the streaming ingest to completion and returns how many rows were written.
+def clean_data_streaming(file_path, chunksize=default_chunksize, json_path="merged_data.json", use_mongo=True,
+                         batch_size=default_batch_size):
+    row_count = 0
+    for cleaned_chunk in stream_clean_data(file_path, chunksize, json_path, use_mongo, batch_size):
+        row_count += len(cleaned_chunk)
+    return row_count
+
+# Hash of a document's content, stored alongside it so unchanged documents can be skipped
+def document_hash(document):
+    content = {key: value for key, value in document.items() if key not in ('_id', '_content_hash')}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+# Older runs used insert_many, so the collection may hold several copies of the same id.
+# Keep the first copy of each so the unique index on id can be built.
+def remove_duplicate_ids(collection):
+    duplicates = collection.aggregate([
+        {"$group": {"_id": "$id", "copies": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for duplicate in duplicates:
+        collection.delete_many({"_id": {"$in": duplicate["copies"][1:]}})
+
+def ensure_id_index(collection):
+    try:
+        collection.create_index("id", unique=True)
+    except OperationFailure:
+        remove_duplicate_ids(collection)
+        collection.create_index("id", unique=True)
+
+# Writes the documents as batched, unordered bulk upserts keyed on the transmitter id.
+# Each batch first looks up the stored content hashes for its ids, and only documents that
+# are new or have changed are sent, so re-running on an unchanged snapshot writes nothing.
+# The collection is passed in, so this works the same against mongod or an in-process
+# stand-in such as mongomock.
+# progress, if given, is called with the fraction of documents processed after each batch.
+def upsert_documents(collection, documents, batch_size=default_batch_size, progress=None):
+    ensure_id_index(collection)
+    summary = {"upserted": 0, "modified": 0, "unchanged": 0}
+
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        ids = [int(document['id']) for document in batch]
+        stored_hashes = {
+            stored['id']: stored.get('_content_hash')
+            for stored in collection.find({"id": {"$in": ids}}, {"id": 1, "_content_hash": 1})
+        }
 
-    db = client['dab_database']  # Use or create a database called 'dab_database'
-    collection = db['dab_data']  # Use or create a collection called 'dab_data'
+        operations = []
+        for document_id, document in zip(ids, batch):
+            content_hash = document_hash(document)
+            if stored_hashes.get(document_id) == content_hash:
+                summary["unchanged"] += 1
+                continue
+            replacement = dict(document, id=document_id, _content_hash=content_hash)
+            replacement.pop('_id', None)
+            operations.append(ReplaceOne({"id": document_id}, replacement, upsert=True))
 
-    collection.insert_many(merged_data.to_dict('records'))
+        if operations:
+            result = collection.bulk_write(operations, ordered=False)
+            summary["upserted"] += result.upserted_count
+            summary["modified"] += result.modified_count
+        if progress is not None:
+            progress(min(start + batch_size, len(documents)) / len(documents))
 
-    return merged_data
\ No newline at end of file
+    return summary
@@ -0,0 +1,339 @@
+import io
+import json
+import os
+import shutil
+from itertools import islice
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+# Prepared (cleaned) data can be stored in three formats, picked from the file extension:
+#  - .arrow/.feather: uncompressed Arrow IPC. This is the default cache as it is typed and
+#    can be memory-mapped, so reading a few columns only touches those columns on disk.
+#  - .parquet: compressed and columnar, smaller on disk but has to be decoded on read.
+#  - .ndjson/.jsonl: one JSON record per line. Written and read in batches, so it stays
+#    readable as text but a large file never has to be held in memory as a whole.
+#  - .json: the original indented records format, kept as an export option.
+#  - .dataset: a directory of Parquet files partitioned by Year (and optionally Multiplex),
+#    e.g. merged_data.dataset/Year=2005/part-0.parquet. A filter on the partition columns
+#    skips whole directories before any rows are read.
+arrow_extensions = ('.arrow', '.feather')
+parquet_extensions = ('.parquet',)
+ndjson_extensions = ('.ndjson', '.jsonl')
+json_extensions = ('.json',)
+partitioned_extensions = ('.dataset',)
+
+# Partition columns of a .dataset directory unless save_prepared_data is told otherwise,
+# ['Year', 'Multiplex'] is the other useful layout
+default_partition_columns = ['Year']
+
+# Rows per write when saving NDJSON
+default_ndjson_batch_rows = 10000
+# Bytes of NDJSON parsed per chunk when reading. Arrow's parser needs many times the block
+# size while it works on a block, so this is kept small; going bigger barely changes the speed.
+default_ndjson_block_bytes = 2 * 2**20
+# The column types of an NDJSON file are written next to it (merged_data.ndjson.schema.json)
+# so the reader never has to guess them. A file without one has its types inferred from
+# ndjson_sample_lines lines at a time, reading on until every column has shown a value.
+ndjson_schema_suffix = ".schema.json"
+ndjson_sample_lines = 1000
+_ndjson_types = {"bool": pa.bool_(), "int64": pa.int64(), "float64": pa.float64(), "string": pa.string(),
+                 "null": pa.null()}
+
+# File dialog filters for the formats above, columnar cache first. A .dataset is a
+# directory, which a file open dialog can't pick, so it is only offered when saving.
+prepared_file_filetypes = [
+    ("Arrow cache", "*.arrow *.feather"),
+    ("Parquet files", "*.parquet"),
+    ("NDJSON files", "*.ndjson *.jsonl"),
+    ("JSON files", "*.json"),
+]
+prepared_data_filetypes = prepared_file_filetypes + [("Partitioned dataset", "*.dataset")]
+
+def storage_format(path):
+    lowered = str(path).lower().rstrip("/\\")
+    if lowered.endswith(partitioned_extensions):
+        return "partitioned"
+    if lowered.endswith(arrow_extensions):
+        return "arrow"
+    if lowered.endswith(parquet_extensions):
+        return "parquet"
+    if lowered.endswith(ndjson_extensions):
+        return "ndjson"
+    if lowered.endswith(json_extensions):
+        return "json"
+    raise ValueError(f"Unsupported prepared data format: {path}")
+
+def save_prepared_data(df, path, partition_columns=default_partition_columns):
+    file_format = storage_format(path)
+    # attrs only hold in-memory helpers (e.g. the packed ERP patterns) that are rebuilt from
+    # the columns after loading, so they are not written out
+    if df.attrs:
+        df = df.copy(deep=False)
+        df.attrs = {}
+    if file_format == "json":
+        df.to_json(path, orient='records', indent=4)
+        return
+    if file_format == "ndjson":
+        write_ndjson(df, path)
+        return
+
+    # The index is just a row counter after cleaning so there is no point storing it
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if file_format == "partitioned":
+        write_partitioned(table, path, partition_columns)
+    elif file_format == "arrow":
+        # Left uncompressed on purpose, compressed buffers can't be memory-mapped
+        feather.write_feather(table, path, compression='uncompressed')
+    else:
+        pq.write_table(table, path)
+
+# Loads prepared data, optionally only the given columns, with dtypes mapping columns to the
+# types they should end up as. For the columnar formats and NDJSON the columns we don't ask
+# for are never converted.
+#
+# filters keeps only the matching rows, in the same form pandas.read_parquet takes, e.g.
+# [('Year', '>=', 2001), ('Multiplex', 'in', ['C18A', 'C18F'])]. For a partitioned dataset
+# the partitions that can't match are never opened, for Parquet the row groups whose
+# min/max rule them out are skipped, the other formats are filtered as they are read.
+def load_prepared_data(path, columns=None, dtypes=None, filters=None):
+    file_format = storage_format(path)
+    if file_format == "json":
+        with open(path, "r") as file:
+            data = json.load(file)
+        df = _filter_frame(pd.DataFrame(data), filters)
+        df = df[columns] if columns is not None else df
+        return _coerce(df, dtypes)
+
+    if file_format == "ndjson":
+        chunks = list(iter_prepared_chunks(path, columns, dtypes, filters=filters))
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+
+    if file_format == "partitioned" or filters:
+        table = _dataset(path, file_format).to_table(columns=columns, filter=_filter_expression(filters))
+    elif file_format == "arrow":
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    return _coerce(table.to_pandas(), dtypes)
+
+# Yields prepared data as DataFrame chunks, so it can go straight into the chunked consumers
+# like printStats while the rest of the file is still unread. Memory stays at about one chunk
+# whatever the file size, except for the indented .json format which has no way to be read in
+# parts and comes back as a single chunk. columns, dtypes and filters work as for
+# load_prepared_data.
+def iter_prepared_chunks(path, columns=None, dtypes=None, block_bytes=default_ndjson_block_bytes, filters=None):
+    file_format = storage_format(path)
+    if file_format == "json":
+        yield load_prepared_data(path, columns, dtypes, filters)
+    elif file_format == "ndjson":
+        # The filter columns have to be read even when they aren't wanted in the result
+        wanted = None if columns is None else list(dict.fromkeys(list(columns) + _filter_columns(filters)))
+        for chunk in _iter_ndjson(path, wanted, dtypes, block_bytes):
+            chunk = _filter_frame(chunk, filters)
+            yield chunk[columns] if columns is not None else chunk
+    elif file_format == "partitioned" or filters:
+        scanner = _dataset(path, file_format).scanner(columns=columns, filter=_filter_expression(filters))
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield _coerce(batch.to_pandas(), dtypes)
+    elif file_format == "arrow":
+        with pa.memory_map(str(path)) as source:
+            reader = ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index)
+                yield _coerce(batch.select(columns).to_pandas() if columns is not None else batch.to_pandas(), dtypes)
+    else:
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(columns=columns):
+            yield _coerce(batch.to_pandas(), dtypes)
+
+# Writes a .dataset directory, one folder per value of each partition column
+# (Year=2005/Multiplex=C18A/...). Anything already at path is replaced.
+def write_partitioned(table, path, partition_columns=default_partition_columns):
+    # A partition value has to be a plain value, not a categorical's dictionary code
+    for column in partition_columns:
+        field_type = table.schema.field(column).type
+        if pa.types.is_dictionary(field_type):
+            table = table.set_column(table.schema.get_field_index(column), column,
+                                     table[column].cast(field_type.value_type))
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    partitioning = ds.partitioning(pa.schema([table.schema.field(column) for column in partition_columns]),
+                                   flavor="hive")
+    ds.write_dataset(table, path, format="parquet", partitioning=partitioning)
+    # The partition columns are only in the folder names, keep the original column order so
+    # reading it back gives the same frame
+    with open(os.path.join(path, "_columns.json"), "w") as columns_file:
+        json.dump(table.schema.names, columns_file)
+
+# The files a filter would actually read, e.g. to see how much partition pruning saves
+def partition_files(path, filters=None):
+    dataset = _dataset(path, storage_format(path))
+    return [fragment.path for fragment in dataset.get_fragments(filter=_filter_expression(filters))]
+
+def _dataset(path, file_format):
+    if file_format != "partitioned":
+        return ds.dataset(path, format="ipc" if file_format == "arrow" else "parquet")
+    dataset = ds.dataset(path, format="parquet", partitioning="hive",
+                         exclude_invalid_files=True, ignore_prefixes=[".", "_"])
+    columns_path = os.path.join(path, "_columns.json")
+    if os.path.exists(columns_path):
+        with open(columns_path) as columns_file:
+            names = json.load(columns_file)
+        dataset = dataset.replace_schema(pa.schema([dataset.schema.field(name) for name in names]))
+    return dataset
+
+def _filter_expression(filters):
+    return pq.filters_to_expression(filters) if filters else None
+
+def _filter_columns(filters):
+    return [column for column, _, _ in filters or []]
+
+_filter_operations = {
+    '==': lambda values, value: values == value,
+    '=': lambda values, value: values == value,
+    '!=': lambda values, value: values != value,
+    '<': lambda values, value: values < value,
+    '<=': lambda values, value: values <= value,
+    '>': lambda values, value: values > value,
+    '>=': lambda values, value: values >= value,
+    'in': lambda values, value: values.isin(value),
+    'not in': lambda values, value: ~values.isin(value),
+}
+
+def _filter_frame(df, filters):
+    if not filters:
+        return df
+    keep = np.ones(len(df), dtype=bool)
+    for column, operation, value in filters:
+        keep &= _filter_operations[operation](df[column], value).fillna(False).to_numpy(dtype=bool)
+    return df[keep].reset_index(drop=True)
+
+# Streams the frame out one batch of rows at a time, each row on its own line. Text columns
+# that also hold a few numbers (read_csv does this for some of the sparse LSN and SId columns)
+# are written as all text, as a column has to keep one type for the reader.
+def write_ndjson(df, path, batch_size=default_ndjson_batch_rows):
+    mixed = [column for column in df.columns
+             if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed')]
+    if mixed:
+        df = df.copy(deep=False)
+        for column in mixed:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    with open(path, "w", encoding="utf-8") as file:
+        for start in range(0, len(df), batch_size):
+            lines = df.iloc[start:start + batch_size].to_json(orient='records', lines=True, force_ascii=False)
+            file.write(lines if lines.endswith("\n") else lines + "\n")
+    with open(str(path) + ndjson_schema_suffix, "w") as schema_file:
+        json.dump([[column, _ndjson_type(df[column])] for column in df.columns], schema_file)
+
+# The JSON type a column's values are written as. Dates are written as epoch milliseconds,
+# a categorical as whatever its categories are.
+def _ndjson_type(values):
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return _ndjson_type(pd.Series(dtype.categories))
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+        return "int64"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float64"
+    if dtype == object:
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred == "boolean":
+            return "bool"
+        if inferred == "integer":
+            return "int64"
+        if inferred in ("floating", "mixed-integer-float"):
+            return "float64"
+    return "string"
+
+# The NDJSON file is parsed by Arrow a block at a time. The schema handed to the parser holds
+# only the wanted columns (the rest of each line is skipped) with their final types, so the
+# values are converted as they are parsed rather than in a second pass.
+def _iter_ndjson(path, columns, dtypes, block_bytes):
+    schema = _ndjson_schema(path, columns, dtypes)
+    if schema is None:
+        return
+    parse_options = pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior='ignore')
+    read_options = pa_json.ReadOptions(block_size=block_bytes)
+    with pa_json.open_json(path, read_options=read_options, parse_options=parse_options) as reader:
+        for batch in reader:
+            yield _coerce(batch.to_pandas(), _pandas_only_dtypes(dtypes))
+
+# Column types from the schema written with the file, or inferred when there is none, with
+# the ones in dtypes taking over
+def _ndjson_schema(path, columns, dtypes):
+    known = _written_ndjson_types(path)
+    if known is None:
+        known = _inferred_ndjson_types(path)
+    if not known:
+        return None
+    names = columns if columns is not None else list(known)
+    fields = []
+    for name in names:
+        if dtypes and name in dtypes and _arrow_type(dtypes[name]) is not None:
+            field_type = _arrow_type(dtypes[name])
+        else:
+            field_type = known.get(name, pa.null())
+        fields.append(pa.field(name, field_type))
+    return pa.schema(fields)
+
+def _written_ndjson_types(path):
+    schema_path = str(path) + ndjson_schema_suffix
+    if not os.path.exists(schema_path):
+        return None
+    with open(schema_path) as schema_file:
+        return {name: _ndjson_types[type_name] for name, type_name in json.load(schema_file)}
+
+# Infers the types a sample of lines at a time. A column that is null in a sample is looked
+# for again in the next one rather than being fixed as text, and one that is null all
+# the way through is read as null.
+def _inferred_ndjson_types(path):
+    known = {}
+    unresolved = set()
+    with open(path, "rb") as file:
+        while True:
+            sample = b"".join(islice(file, ndjson_sample_lines))
+            if not sample.strip():
+                break
+            schema = pa_json.read_json(io.BytesIO(sample)).schema
+            for field in schema:
+                if field.name not in known or field.name in unresolved:
+                    known[field.name] = field.type
+                    if field.type == pa.null():
+                        unresolved.add(field.name)
+                    else:
+                        unresolved.discard(field.name)
+            if not unresolved:
+                break
+    return known
+
+# The Arrow type to parse a column as, or None for types only pandas has, like category,
+# which are applied to each chunk after parsing
+def _arrow_type(dtype):
+    if isinstance(dtype, pa.DataType):
+        return dtype
+    if dtype in (str, 'str', 'string', object, 'object'):
+        return pa.string()
+    try:
+        return pa.from_numpy_dtype(np.dtype(dtype))
+    except TypeError:
+        return None
+
+def _pandas_only_dtypes(dtypes):
+    if not dtypes:
+        return None
+    return {column: dtype for column, dtype in dtypes.items() if _arrow_type(dtype) is None}
+
+def _coerce(df, dtypes):
+    if not dtypes:
+        return df
+    wanted = {column: dtype for column, dtype in dtypes.items()
+              if column in df and not isinstance(dtype, pa.DataType)}
+    return df.astype(wanted) if wanted else df
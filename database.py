@@ -0,0 +1,138 @@
+import atexit
+import os
+import threading
+import bson
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from bson.codec_options import CodecOptions
+from pymongo import MongoClient
+
+try:
+    # Decodes the raw BSON batches straight into typed Arrow columns. pymongoarrow 1.15 is
+    # built for pyarrow 25.0.x (it requires pyarrow>=25.0,<25.1), the two are upgraded together.
+    from pymongoarrow.api import Schema
+    from pymongoarrow.context import PyMongoArrowContext
+except ImportError:
+    # Without it batches are decoded through a dict per document, which works but is slower
+    PyMongoArrowContext = None
+
+# All MongoDB access goes through this module. There is one MongoClient per process,
+# created the first time it is needed, and its connection pool is reused by every button
+# press instead of paying connection setup and topology discovery each time.
+# The settings can be overridden with environment variables or configure_database().
+mongo_settings = {
+    "uri": os.environ.get("DAB_MONGO_URI", "mongodb://localhost:27017/"),
+    "database": os.environ.get("DAB_MONGO_DATABASE", "dab_database"),
+    "collection": os.environ.get("DAB_MONGO_COLLECTION", "dab_data"),
+    "max_pool_size": int(os.environ.get("DAB_MONGO_POOL_SIZE", "20")),
+    "server_selection_timeout_ms": int(os.environ.get("DAB_MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connect_timeout_ms": int(os.environ.get("DAB_MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "socket_timeout_ms": int(os.environ.get("DAB_MONGO_SOCKET_TIMEOUT_MS", "60000")),
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+# Changes the connection settings. Any open client is closed so the next call picks them up.
+def configure_database(**settings):
+    unknown = set(settings) - set(mongo_settings)
+    if unknown:
+        raise ValueError(f"Unknown MongoDB settings: {', '.join(sorted(unknown))}")
+    close_client()
+    mongo_settings.update(settings)
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    mongo_settings["uri"],
+                    maxPoolSize=mongo_settings["max_pool_size"],
+                    serverSelectionTimeoutMS=mongo_settings["server_selection_timeout_ms"],
+                    connectTimeoutMS=mongo_settings["connect_timeout_ms"],
+                    socketTimeoutMS=mongo_settings["socket_timeout_ms"],
+                )
+    return _client
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+atexit.register(close_client)
+
+def get_collection():
+    return get_client()[mongo_settings["database"]][mongo_settings["collection"]]
+
+# Number of rows in each batch the server sends back, and so in each DataFrame batch
+default_fetch_batch_size = 10000
+
+# Plain dicts decode fastest, the default SON keeps ordering we don't need here
+_decode_options = CodecOptions(document_class=dict)
+
+# Only the requested fields are sent over the wire, and not _id
+def columnar_projection(fields):
+    for field in fields:
+        if "." in field or field.startswith("$"):
+            raise ValueError(f"Can't fetch field {field!r} in columnar batches")
+    projection = {field: 1 for field in fields}
+    projection["_id"] = 0
+    return projection
+
+# The Arrow type each field is decoded as: the dtype asked for in dtypes, or text. A dtype
+# Arrow has no type for, like category, is decoded as text and applied afterwards.
+def arrow_schema(fields, dtypes=None):
+    types = {}
+    for field in fields:
+        dtype = (dtypes or {}).get(field)
+        try:
+            types[field] = pa.string() if dtype is None else pa.from_numpy_dtype(np.dtype(dtype))
+        except TypeError:
+            types[field] = pa.string()
+    return types
+
+# Turns one raw BSON batch from the cursor into a DataFrame with one typed column per field.
+# A missing field, or a value that doesn't fit its field's type, comes back as null.
+def decode_raw_batch(raw_batch, fields, dtypes=None):
+    if PyMongoArrowContext is not None:
+        context = PyMongoArrowContext(Schema(arrow_schema(fields, dtypes)), codec_options=_decode_options,
+                                      allow_invalid=True)
+        context.process_bson_stream(raw_batch)
+        batch = context.finish().to_pandas()
+    else:
+        documents = bson.decode_all(raw_batch, _decode_options)
+        batch = pd.DataFrame({field: [document.get(field) for document in documents] for field in fields},
+                             columns=list(fields))
+    for field, dtype in (dtypes or {}).items():
+        column = batch[field]
+        if pd.api.types.is_numeric_dtype(dtype):
+            column = pd.to_numeric(column, errors='coerce')
+        batch[field] = column.astype(dtype)
+    return batch
+
+# Streams the matching documents as one DataFrame per batch the server sends. The batches
+# are taken off the cursor as raw BSON and decoded column by column, so the documents are
+# never turned into Python objects, and a streaming consumer only holds one batch at a
+# time. This is a plain find, so it works on any server version.
+def iter_query_batches(query, fields, dtypes=None, batch_size=default_fetch_batch_size):
+    cursor = get_collection().find_raw_batches(query, columnar_projection(fields), batch_size=batch_size)
+    for raw_batch in cursor:
+        batch = decode_raw_batch(raw_batch, fields, dtypes)
+        if len(batch):
+            yield batch
+
+def iter_multiplex_batches(multiplexes, fields, dtypes=None, batch_size=default_fetch_batch_size):
+    query = {"Multiplex": {"$in": list(multiplexes)}}
+    return iter_query_batches(query, fields, dtypes, batch_size)
+
+# Documents whose Multiplex is one of the given multiplexes, with only the given fields.
+# Returned as a DataFrame with the Mongo _id left out.
+def find_multiplex_documents(multiplexes, fields, dtypes=None, batch_size=default_fetch_batch_size):
+    batches = list(iter_multiplex_batches(multiplexes, fields, dtypes, batch_size))
+    if not batches:
+        return pd.DataFrame(columns=list(fields))
+    return pd.concat(batches, ignore_index=True)
@@ -0,0 +1,46 @@
+import hashlib
+from collections import OrderedDict
+import pandas as pd
+
+# Things built from a cleaned dataset (the spatial index, the range query engine and its
+# results) are kept per dataset version so asking again doesn't build them again. A version
+# can be anything identifying the dataset, e.g. the pipeline_cache key of the inputs; when
+# there is none, dataset_version fingerprints the columns the built thing depends on.
+def dataset_version(df, columns):
+    columns = [column for column in columns if column in df]
+    hashed = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    return hashlib.sha256(hashed.tobytes()).hexdigest()
+
+# A least recently used cache holding at most max_entries values
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    # The cached value for key, built with build() the first time it is asked for
+    def get_or_build(self, key, build):
+        if key in self._entries:
+            return self.get(key)
+        return self.put(key, build())
+
+    def clear(self):
+        self._entries.clear()
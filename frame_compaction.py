@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# Free text columns that only take a small set of values across the whole dataset
+category_columns = ['Multiplex', 'Ensemble', 'Site', 'Licence', 'Ensemble Area', 'Transmitter Area']
+
+# The Serv Label and Data Serv Label columns repeat the same few hundred station names too
+def label_columns(df):
+    return [column for column in df.columns if 'Serv Label' in column]
+
+# Shrinks the cleaned frame in place: any 'Yes'/'No' indicator columns (as older prepared files
+# hold them) become booleans, the low cardinality text columns categoricals, integer columns the smallest integer type that holds
+# them and float columns float32 where that keeps every value exactly. Floats that would
+# change, like most of the power values, stay float64 so the statistics come out the same.
+# Returns the frame and a before/after memory report.
+def compact_frame(df, indicator_columns=()):
+    before = memory_usage(df)
+
+    for column in indicator_columns:
+        if column in df and pd.api.types.is_string_dtype(df[column]):
+            df[column] = df[column] == 'Yes'
+
+    for column in category_columns + label_columns(df):
+        if column in df and pd.api.types.is_string_dtype(df[column]):
+            df[column] = df[column].astype('category')
+
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values) and values.dtype != np.float32:
+            narrowed = values.astype(np.float32)
+            if ((narrowed.astype(np.float64) == values) | values.isna()).all():
+                df[column] = narrowed
+
+    return df, memory_report(before, memory_usage(df))
+
+# Deep memory usage in bytes, per column and in total
+def memory_usage(df):
+    usage = df.memory_usage(deep=True, index=True)
+    return {"columns": usage.drop('Index').to_dict(), "total": int(usage.sum())}
+
+def memory_report(before, after):
+    saved = {column: int(before["columns"][column] - after["columns"].get(column, 0))
+             for column in before["columns"]}
+    largest = sorted(saved.items(), key=lambda item: -item[1])[:10]
+    return {
+        "Before (MB)": round(before["total"] / 2**20, 2),
+        "After (MB)": round(after["total"] / 2**20, 2),
+        "Reduction": round(1 - after["total"] / before["total"], 3) if before["total"] else 0.0,
+        "Largest savings (MB)": {column: round(size / 2**20, 2) for column, size in largest},
+    }
+
+def print_memory_report(report):
+    print(f"Memory usage before compaction: {report['Before (MB)']} MB")
+    print(f"Memory usage after compaction: {report['After (MB)']} MB "
+          f"({report['Reduction']:.1%} smaller)")
@@ -0,0 +1,106 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# Synthetic TxAntennaDAB.csv/TxParamsDAB.csv pairs of any size, for benchmarking the pipeline
+# as the data grows. Rows are resampled from the real files so every column, the ensemble
+# line-ups (EID, Block, Freq and the service labels go together) and the quirks come through
+# as they are: the Params file is latin1, some dates and ERPs are empty, the excluded NGRs turn
+# up at their real rate and ERP is written like "2.000,000". On top of that every row gets a
+# new id, a random dd/mm/yyyy date and jittered heights, power and position.
+#
+#   python generate_dab_data.py --rows 1000000 --output-dir synthetic_1m
+
+default_chunk_rows = 100000
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic DAB dataset pair.")
+    parser.add_argument("--rows", type=int, required=True, help="Number of transmitters to generate")
+    parser.add_argument("--output-dir", required=True, help="Where the two CSV files go")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed, the same seed gives the same files")
+    parser.add_argument("--antenna-template", default="TxAntennaDAB.csv", help="Real antenna CSV to resample")
+    parser.add_argument("--params-template", default="TxParamsDAB.csv", help="Real params CSV to resample")
+    return parser.parse_args(argv)
+
+# Both templates are read entirely as text, with empty fields kept as empty strings, so the
+# rows are written back out exactly as they were apart from the columns changed below
+def load_templates(antenna_path="TxAntennaDAB.csv", params_path="TxParamsDAB.csv"):
+    antenna = pd.read_csv(antenna_path, dtype=str, keep_default_na=False)
+    params = pd.read_csv(params_path, dtype=str, keep_default_na=False, encoding='latin1')
+    # Line the antenna rows up with the params rows so a sampled row keeps its own site
+    antenna = antenna.set_index('id').reindex(params['id']).fillna('').reset_index()
+    return antenna, params
+
+# kW as the files write it: six decimal places with a comma before the last three,
+# 8.510009 -> "8.510,009"
+def format_power(power_kw):
+    text = pd.Series(power_kw).map('{:.6f}'.format)
+    return text.str[:-3] + ',' + text.str[-3:]
+
+def parse_power(text):
+    return pd.to_numeric(text.str.replace(',', ''), errors='coerce').to_numpy()
+
+def format_dates(rng, rows):
+    days = rng.integers(1, 29, rows)
+    months = rng.integers(1, 13, rows)
+    years = rng.integers(1995, 2025, rows)
+    return [f"{day:02d}/{month:02d}/{year}" for day, month, year in zip(days, months, years)]
+
+def generate_chunk(rng, antenna, params, first_id, rows):
+    picks = rng.integers(0, len(params), rows)
+    antenna_rows = antenna.iloc[picks].reset_index(drop=True)
+    params_rows = params.iloc[picks].reset_index(drop=True)
+
+    ids = np.arange(first_id, first_id + rows).astype(str)
+    antenna_rows['id'] = ids
+    params_rows['id'] = ids
+
+    # Dates are replaced except where the template had none
+    has_date = params_rows['Date'] != ''
+    params_rows.loc[has_date, 'Date'] = format_dates(rng, int(has_date.sum()))
+
+    # Heights and power are scaled by up to about +-20%, keeping the template's empty ERPs
+    for column in ('Site Height', 'In-Use Ae Ht'):
+        values = pd.to_numeric(antenna_rows[column], errors='coerce').to_numpy()
+        scaled = np.round(values * rng.uniform(0.8, 1.2, rows))
+        antenna_rows[column] = np.where(np.isnan(scaled), antenna_rows[column], pd.Series(scaled).map('{:.0f}'.format))
+    power = parse_power(antenna_rows['In-Use ERP Total'])
+    scaled_power = np.round(power * rng.lognormal(0, 0.2, rows), 6)
+    antenna_rows['In-Use ERP Total'] = np.where(np.isnan(scaled_power), antenna_rows['In-Use ERP Total'],
+                                                format_power(np.nan_to_num(scaled_power)))
+
+    # Moved by up to a couple of km so that sites don't all sit on top of each other
+    for column in ('Lat', 'Long'):
+        values = pd.to_numeric(antenna_rows[column], errors='coerce').to_numpy()
+        moved = np.round(values + rng.uniform(-0.02, 0.02, rows), 6)
+        antenna_rows[column] = np.where(np.isnan(moved), antenna_rows[column], pd.Series(moved).map('{:.6f}'.format))
+
+    return antenna_rows, params_rows
+
+# Writes the pair in chunks so even 10^7 rows never need the whole dataset in memory.
+# Returns the two file paths.
+def generate_dataset(rows, output_dir, seed=0, antenna_template="TxAntennaDAB.csv",
+                     params_template="TxParamsDAB.csv", chunk_rows=default_chunk_rows):
+    os.makedirs(output_dir, exist_ok=True)
+    antenna, params = load_templates(antenna_template, params_template)
+    rng = np.random.default_rng(seed)
+    first_id = int(params['id'].astype(int).min())
+
+    antenna_path = os.path.join(output_dir, "TxAntennaDAB.csv")
+    params_path = os.path.join(output_dir, "TxParamsDAB.csv")
+    with open(antenna_path, "w", newline="") as antenna_file, \
+            open(params_path, "w", newline="", encoding="latin1") as params_file:
+        written = 0
+        while written < rows:
+            chunk = min(chunk_rows, rows - written)
+            antenna_rows, params_rows = generate_chunk(rng, antenna, params, first_id + written, chunk)
+            antenna_rows.to_csv(antenna_file, index=False, header=written == 0)
+            params_rows.to_csv(params_file, index=False, header=written == 0)
+            written += chunk
+    return antenna_path, params_path
+
+if __name__ == "__main__":
+    args = parse_args()
+    paths = generate_dataset(args.rows, args.output_dir, args.seed, args.antenna_template, args.params_template)
+    print("\n".join(paths))
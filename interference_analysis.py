@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from antenna_pattern import erp_patterns
+from spatial_index import SpatialIndex
+
+# Co-channel interference: transmitters on the same Block (and so the same Freq) whose
+# coverage could overlap. Transmitters of the same ensemble on the same block are a single
+# frequency network and are meant to overlap, so by default only pairs from different
+# ensembles count as conflicts.
+#
+# Rather than comparing every pair, each block gets its own spatial index and only pairs
+# closer than max_distance_km are looked at. Each of those is scored with the ERP each
+# transmitter radiates towards the other from its 36-bearing pattern.
+default_max_distance_km = 100.0
+
+# Initial great-circle bearing in degrees from point 1 towards point 2
+def initial_bearing(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    delta_lon = lon2 - lon1
+    x = np.sin(delta_lon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(delta_lon)
+    return np.mod(np.degrees(np.arctan2(x, y)), 360.0)
+
+# Every pair of transmitters on the same block within max_distance_km, once each
+def candidate_pairs(df, max_distance_km=default_max_distance_km):
+    pairs = []
+    located = df.dropna(subset=['Block', 'Lat', 'Long'])
+    for block, block_data in located.groupby('Block', sort=True):
+        if len(block_data) < 2:
+            continue
+        index = SpatialIndex(block_data)
+        nearby = index.within_radius_batch(index.lat, index.lon, max_distance_km)
+        nearby['id_a'] = index.ids[nearby['query'].to_numpy()]
+        nearby = nearby[nearby['id_a'] < nearby['id']]
+        pairs.append(pd.DataFrame({
+            'Block': block,
+            'id_a': nearby['id_a'].to_numpy(),
+            'id_b': nearby['id'].to_numpy(),
+            'distance_km': nearby['distance_km'].to_numpy(),
+        }))
+    if not pairs:
+        return pd.DataFrame(columns=['Block', 'id_a', 'id_b', 'distance_km'])
+    return pd.concat(pairs, ignore_index=True)
+
+# ERP in kW from each transmitter in ids towards the given bearings. A transmitter with no
+# published pattern is treated as radiating its full ERP in every direction.
+def _erp_towards(patterns, ids, bearings):
+    pair_patterns = patterns.for_ids(ids)
+    erp = pair_patterns.erp_at(bearings)
+    return np.where(np.isnan(erp), pair_patterns.peak_erp_kw, erp)
+
+# Ranked conflict table. interference_score is the stronger of the two ERPs towards the
+# other site divided by the distance squared (kW/km^2), a free-space proxy for how much of
+# one transmitter's signal lands on the other; the table is sorted by it, worst first.
+def find_cochannel_conflicts(df, max_distance_km=default_max_distance_km, include_same_ensemble=False):
+    pairs = candidate_pairs(df, max_distance_km)
+    details = df.drop_duplicates('id').set_index('id')
+    detail_columns = [column for column in ('Site', 'Ensemble', 'EID', 'Multiplex', 'Freq', 'Lat', 'Long') if column in details]
+    for side in ('a', 'b'):
+        side_details = details.loc[pairs[f'id_{side}'], detail_columns].reset_index(drop=True)
+        pairs = pd.concat([pairs, side_details.add_suffix(f'_{side}')], axis=1)
+
+    if not include_same_ensemble and 'Ensemble_a' in pairs:
+        pairs = pairs[pairs['Ensemble_a'] != pairs['Ensemble_b']].reset_index(drop=True)
+
+    patterns = erp_patterns(df.drop_duplicates('id'))
+    pairs['bearing_a_to_b'] = initial_bearing(pairs['Lat_a'], pairs['Long_a'], pairs['Lat_b'], pairs['Long_b'])
+    pairs['bearing_b_to_a'] = initial_bearing(pairs['Lat_b'], pairs['Long_b'], pairs['Lat_a'], pairs['Long_a'])
+    pairs['erp_a_to_b_kw'] = _erp_towards(patterns, pairs['id_a'], pairs['bearing_a_to_b'].to_numpy())
+    pairs['erp_b_to_a_kw'] = _erp_towards(patterns, pairs['id_b'], pairs['bearing_b_to_a'].to_numpy())
+
+    # Co-sited transmitters would divide by zero, count them as 100 m apart
+    distance = np.maximum(pairs['distance_km'].to_numpy(), 0.1)
+    pairs['interference_score'] = np.fmax(pairs['erp_a_to_b_kw'], pairs['erp_b_to_a_kw']) / distance ** 2
+    return pairs.sort_values('interference_score', ascending=False, na_position='last').reset_index(drop=True)
+
+# One ranked table per block
+def conflicts_by_block(conflicts):
+    return {block: table.reset_index(drop=True) for block, table in conflicts.groupby('Block', sort=True)}
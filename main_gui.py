@@ -1,19 +1,39 @@
+import importlib
+import os
+import threading
 import tkinter as tk
-from tkinter import messagebox, filedialog
-import json
-import pandas as pd
+from tkinter import messagebox, filedialog, ttk
 
-from data_processing import clean_data
-from statistics_handler import printStats
-from visualization import visualize_multiplex_data
-from correlation_analysis import analyze_correlation
+from task_runner import BackgroundTaskRunner
+
+# Only Tk and the task runner are imported up front so the window appears straight away.
+# pandas, pymongo, pyarrow, matplotlib and seaborn come in through the modules below, which
+# are imported inside the handlers that need them. The non-plotting ones are also warmed up
+# on a background thread once the window is showing, so the first click rarely waits.
+# Plotting modules are left to first use as matplotlib's backend is best set up on the Tk thread.
+warm_up_modules = ['pandas', 'pyarrow', 'pymongo', 'data_storage', 'database', 'data_processing',
+                   'pipeline_cache', 'streaming_stats', 'statistics_handler', 'range_query']
+
+def warm_up_imports(modules=warm_up_modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            # A missing optional library shows up properly when its feature is used
+            pass
 
 class DABDataGUI:
-    def __init__(self, root):
+    def __init__(self, root, warm_up=True):
         self.root = root
         self.root.title("DAB Data Interface")
         self.file_path = {"Antenna": "", "Params": ""}
         self.cleaned_data = None
+        self.query_engine = None
+        # Name of the job the status label and progress bar are showing, None when idle
+        self.progress_owner = None
+        # Long jobs run on worker threads, results come back to Tk through the runner's queue
+        self.tasks = BackgroundTaskRunner(root, on_progress=self.show_progress)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         
         # Load, Clean, and Save Dataset
         tk.Button(root, text="Load Antenna CSV", command=self.load_antenna).pack(pady=5)
@@ -21,13 +41,90 @@ class DABDataGUI:
         tk.Button(root, text="Clean and Merge Data", command=self.clean_and_merge_data).pack(pady=5)
         tk.Button(root, text="Save Cleaned Data", command=self.save_cleaned_data).pack(pady=5)
         tk.Button(root, text="Load Prepared Data", command=self.load_prepared_data).pack(pady=5)
+        tk.Button(root, text="Load Partitioned Dataset", command=self.load_partitioned_data).pack(pady=5)
         # Display Stats
         tk.Button(root, text="Display Power Statistics", command=self.display_stats).pack(pady=10)
+        tk.Button(root, text="Display Power Statistics from MongoDB", command=self.display_stats_from_mongo).pack(pady=5)
+        tk.Button(root, text="Grouped Power and Height Statistics", command=self.display_grouped_stats).pack(pady=5)
+
+        # Range Manipulation
+        tk.Label(root, text="Enter Minimum Year (for range)").pack(pady=5)
+        self.year_entry = tk.Entry(root)
+        self.year_entry.pack()
+        tk.Label(root, text="Enter Minimum Site Height (for range)").pack(pady=5)
+        self.height_entry = tk.Entry(root)
+        self.height_entry.pack()
+        tk.Button(root, text="Apply Filters and Display Power Statistics", command=self.apply_filters).pack(pady=5)
         
         # Visualization and Analysis
-        tk.Button(root, text="Visualize Multiplex Data", command=visualize_multiplex_data).pack(pady=5)
+        tk.Button(root, text="Visualize Multiplex Data", command=self.visualize_multiplex_data).pack(pady=5)
         tk.Button(root, text="Analyze Correlations", command=self.analyze_correlations).pack(pady=5)
 
+        # Progress of the current background job
+        self.status_label = tk.Label(root, text="Ready")
+        self.status_label.pack(pady=(10, 0))
+        self.progress_bar = ttk.Progressbar(root, length=250, mode='determinate', maximum=1.0)
+        self.progress_bar.pack(pady=5)
+        self.cancel_button = tk.Button(root, text="Cancel Clean and Merge", state=tk.DISABLED,
+                                       command=lambda: self.tasks.cancel("clean"))
+        self.cancel_button.pack(pady=5)
+
+        if warm_up:
+            self.root.after(100, lambda: threading.Thread(target=warm_up_imports, daemon=True).start())
+
+    # Starts a job on the background runner. Clicking a button again while its job is
+    # still running is rejected rather than starting a second copy. The status label and
+    # progress bar show one job at a time: the clean job always takes them over, any other
+    # job only gets them when nothing else is showing, and the rest run quietly.
+    def run_in_background(self, name, description, func, on_done):
+        started = self.tasks.submit(name, func, on_done=lambda result: self.task_finished(name, on_done, result),
+                                    on_error=lambda error: self.task_failed(name, error),
+                                    on_cancelled=lambda: self.task_cancelled(name))
+        if not started:
+            messagebox.showwarning("Already Running", f"{description} is already running.")
+            return
+        if self.progress_owner is None or name == "clean":
+            self.progress_owner = name
+            self.status_label.config(text=f"{description}...")
+            self.progress_bar.config(mode='indeterminate')
+            self.progress_bar.start()
+
+    def show_progress(self, name, stage, fraction):
+        if name != self.progress_owner:
+            return
+        self.status_label.config(text=stage)
+        if fraction is not None:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', value=fraction)
+
+    # Only the job showing in the progress widgets resets them, and only the clean job's end
+    # turns its cancel button off
+    def reset_progress(self, name, text):
+        if name == "clean":
+            self.cancel_button.config(state=tk.DISABLED)
+        if name != self.progress_owner:
+            return
+        self.progress_owner = None
+        self.progress_bar.stop()
+        self.progress_bar.config(mode='determinate', value=0)
+        self.status_label.config(text=text)
+
+    def task_finished(self, name, on_done, result):
+        self.reset_progress(name, "Ready")
+        on_done(result)
+
+    def task_failed(self, name, error):
+        self.reset_progress(name, "Failed")
+        messagebox.showerror("Error", f"An error occurred: {str(error)}")
+
+    def task_cancelled(self, name):
+        self.reset_progress(name, "Cancelled")
+        messagebox.showinfo("Cancelled", "The job was cancelled.")
+
+    def close(self):
+        self.tasks.shutdown()
+        self.root.destroy()
+
     def load_antenna(self):
         self.file_path["Antenna"] = filedialog.askopenfilename(title="Select Antenna CSV File",
                                                                 filetypes=[("CSV file", "*.csv")])
@@ -42,45 +139,155 @@ class DABDataGUI:
         if not self.file_path["Antenna"] or not self.file_path["Params"]:
             messagebox.showwarning("Missing Files", "Please load both Antenna and Params CSV files.")
             return
-        self.cleaned_data = clean_data(self.file_path)
-        messagebox.showinfo("Data Cleaned", "Data has been cleaned and merged successfully.")
+        from pipeline_cache import cached_clean_data
+
+        # Copy the paths so picking new files while this runs doesn't change the job
+        file_path = dict(self.file_path)
+        self.run_in_background("clean", "Cleaning and merging data",
+                               lambda progress: cached_clean_data(file_path, progress),
+                               self.clean_and_merge_done)
+        if self.tasks.is_running("clean"):
+            self.cancel_button.config(state=tk.NORMAL)
+
+    def clean_and_merge_done(self, cleaned_data):
+        self.cleaned_data = cleaned_data
+        message = "Data has been cleaned and merged successfully."
+        # A fresh run (not one loaded from the cache) has its stage timings attached
+        run_report = cleaned_data.attrs.get('run_report')
+        if run_report and run_report["stages"]:
+            slowest = max(run_report["stages"], key=lambda stage: stage["wall_seconds"])
+            message += (f"\n\nTook {run_report['wall_seconds']:.1f}s, slowest stage: "
+                        f"{slowest['stage']} ({slowest['wall_seconds']:.1f}s)")
+        messagebox.showinfo("Data Cleaned", message)
 
     def load_prepared_data(self):
+        from data_storage import prepared_file_filetypes
+
         file_path = filedialog.askopenfilename(
-            title="Select Prepared Data JSON File",
-            filetypes=[("JSON files", "*.json")]
+            title="Select Prepared Data File",
+            filetypes=prepared_file_filetypes
         )
         if file_path:  # Proceed only if a file is selected
-            try:
-                # Load the JSON file into a DataFrame
-                with open(file_path, "r") as file:
-                    data = json.load(file)
-                self.cleaned_data = pd.DataFrame(data)
-                messagebox.showinfo("Data Load", f"Prepared data successfully loaded from: {file_path}")
-            except Exception as e:
-                messagebox.showerror("Error", f"An error occurred: {str(e)}")
+            from data_storage import partitioned_extensions
+            # A file picked from inside a .dataset folder (e.g. its _columns.json) stands for
+            # the whole dataset, it isn't prepared data on its own
+            folder = os.path.dirname(file_path)
+            self.load_prepared_path(folder if folder.lower().endswith(partitioned_extensions) else file_path)
         else:
             messagebox.showwarning("File Selection", "No file selected.")
+
+    # A partitioned dataset is a directory, so it is picked with a directory dialog
+    def load_partitioned_data(self):
+        from data_storage import partitioned_extensions
+
+        dataset_path = filedialog.askdirectory(title="Select Partitioned Dataset (.dataset folder)")
+        if not dataset_path:
+            messagebox.showwarning("Folder Selection", "No folder selected.")
+        elif not dataset_path.rstrip("/\\").lower().endswith(partitioned_extensions):
+            messagebox.showwarning("Folder Selection", "Please select a folder ending in .dataset.")
+        else:
+            self.load_prepared_path(dataset_path)
+
+    def load_prepared_path(self, file_path):
+        from data_storage import load_prepared_data
+
+        try:
+            # Load the Arrow/Parquet cache, partitioned dataset or JSON export into a DataFrame
+            self.cleaned_data = load_prepared_data(file_path)
+            messagebox.showinfo("Data Load", f"Prepared data successfully loaded from: {file_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {str(e)}")
             
     def save_cleaned_data(self):
+        from data_storage import save_prepared_data, prepared_data_filetypes
+
         if self.cleaned_data is not None:
-            save_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+            save_path = filedialog.asksaveasfilename(defaultextension=".arrow", filetypes=prepared_data_filetypes)
             if save_path:
-                self.cleaned_data.to_json(save_path, orient='records', indent=4)
+                # The extension picks the format, .json still exports the old JSON records
+                save_prepared_data(self.cleaned_data, save_path)
                 messagebox.showinfo("Data Saved", f"Data saved to: {save_path}")
         else:
             messagebox.showwarning("Data Not Cleaned", "Please clean and merge data first.")
 
     def display_stats(self):
+        from statistics_handler import printStats
+
+        if self.cleaned_data is not None:
+            cleaned_data = self.cleaned_data
+            self.run_in_background("stats", "Calculating power statistics",
+                                   lambda progress: printStats(cleaned_data),
+                                   lambda result: messagebox.showinfo("Stats Displayed", "Power statistics have been displayed in the console."))
+        else:
+            messagebox.showwarning("Data Not Available", "Please clean and merge data first.")
+
+    # Answered by the query engine in range_query.py: its indexes are built the first time this
+    # is used on a dataset, after that each new pair of limits is a few index lookups and
+    # limits that were asked for before come straight from its cache
+    def apply_filters(self):
+        if self.cleaned_data is None:
+            messagebox.showwarning("Data Not Available", "Please clean and merge data first.")
+            return
+
+        try:
+            min_year = int(self.year_entry.get())
+            min_height = float(self.height_entry.get())
+        except ValueError:
+            messagebox.showerror("Invalid Input", "Please enter valid numbers for year and site height.")
+            return
+
+        from range_query import QueryEngine, stats_filter_predicates
+        from statistics_handler import save_stats
+
+        cleaned_data = self.cleaned_data
+        # Kept for as long as the same cleaned data is loaded, so the dataset isn't hashed again
+        engine = self.query_engine if self.query_engine is not None and self.query_engine.df is cleaned_data else None
+
+        def filtered_stats(progress):
+            query_engine = engine or QueryEngine(cleaned_data)
+            stats = query_engine.power_stats(stats_filter_predicates(min_year, min_height))
+            return query_engine, save_stats(stats["Mean"], stats["Mode"], stats["Median"])
+
+        self.run_in_background("filter", "Filtering power statistics", filtered_stats, self.apply_filters_done)
+
+    def apply_filters_done(self, result):
+        self.query_engine = result[0]
+        messagebox.showinfo("Filtered Stats Displayed", "Filtered power statistics displayed in console.")
+
+    def display_grouped_stats(self):
+        from statistics_handler import printGroupedStats
+
         if self.cleaned_data is not None:
-            printStats(self.cleaned_data)
-            messagebox.showinfo("Stats Displayed", "Power statistics have been displayed in the console.")
+            cleaned_data = self.cleaned_data
+            self.run_in_background("grouped_stats", "Calculating grouped statistics",
+                                   lambda progress: printGroupedStats(cleaned_data),
+                                   lambda result: messagebox.showinfo("Stats Saved", "Grouped statistics have been saved to grouped_statistics.json."))
         else:
             messagebox.showwarning("Data Not Available", "Please clean and merge data first.")
 
+    def display_stats_from_mongo(self):
+        from statistics_handler import printStatsFromMongo
+
+        # Runs on the database directly so it doesn't need cleaned data loaded in the GUI
+        self.run_in_background("mongo_stats", "Calculating power statistics in MongoDB",
+                               lambda progress: printStatsFromMongo(),
+                               lambda result: messagebox.showinfo("Stats Displayed", "Power statistics have been displayed in the console."))
+
+    def visualize_multiplex_data(self):
+        from visualization import fetch_multiplex_data, data_displayer
+
+        # The query runs in the background, the figures have to be drawn on the Tk thread
+        self.run_in_background("visualize", "Fetching multiplex data",
+                               lambda progress: fetch_multiplex_data(), data_displayer)
+
     def analyze_correlations(self):
+        from correlation_analysis import preprocess_data, calculate_correlation, plot_correlation_heatmap
+
         if self.cleaned_data is not None:
-            analyze_correlation(self.cleaned_data)
+            cleaned_data = self.cleaned_data
+            self.run_in_background("correlation", "Calculating correlations",
+                                   lambda progress: calculate_correlation(preprocess_data(cleaned_data)),
+                                   plot_correlation_heatmap)
         else:
             messagebox.showwarning("Data Not Available", "Please clean and merge data first.")
 
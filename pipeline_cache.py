@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import tempfile
+from data_processing import clean_data, multiplexes, exclude_these_values, pipeline_version, upsert_documents
+from data_storage import save_prepared_data, load_prepared_data
+from database import get_collection, mongo_settings
+
+# Cleaned frames are cached on disk keyed by the content of both input CSVs plus the
+# cleaning parameters, so pressing "Clean and Merge Data" on unchanged files is a cache hit.
+cache_directory = ".dab_cache"
+# Oldest-used entries are evicted once the cache grows past this many bytes
+max_cache_bytes = 512 * 1024 * 1024
+
+# Hashes we have already worked out this session, keyed by (path, size, mtime) so an
+# unchanged file is not re-read on every click
+_file_hashes = {}
+
+def file_content_hash(path):
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        _file_hashes[stamp] = digest.hexdigest()
+    return _file_hashes[stamp]
+
+def cache_key(file_path):
+    key_parts = {
+        "Antenna": file_content_hash(file_path["Antenna"]),
+        "Params": file_content_hash(file_path["Params"]),
+        "multiplexes": multiplexes,
+        "excluded_ngrs": exclude_these_values,
+        "pipeline_version": pipeline_version,
+    }
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode()).hexdigest()
+
+def _cache_path(key):
+    return os.path.join(cache_directory, f"{key}.arrow")
+
+# Small file next to each entry naming the MongoDB collection its documents were written to
+def _populated_path(key):
+    return os.path.join(cache_directory, f"{key}.populated.json")
+
+# The collection clean_data writes to with the current settings
+def current_collection():
+    return {name: mongo_settings[name] for name in ("uri", "database", "collection")}
+
+# A cache file that can't be read (cut short, or written by an incompatible pyarrow) is
+# dropped and treated as a miss, so the inputs are cleaned again
+def load_cached(key):
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        cleaned_data = load_prepared_data(path)
+    except (OSError, ValueError) as error:
+        print(f"Ignoring unreadable cache entry {path}: {error}")
+        invalidate_cache(key)
+        return None
+    # Touch the entry so eviction treats it as recently used
+    os.utime(path)
+    return cleaned_data
+
+# Written to a temporary file in the cache directory first and then moved into place, so a
+# run that stops half way never leaves a partial entry under the real name
+def store_cached(key, df):
+    os.makedirs(cache_directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=cache_directory, prefix=".tmp-", suffix=".arrow")
+    os.close(handle)
+    try:
+        save_prepared_data(df, temp_path)
+        os.replace(temp_path, _cache_path(key))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    evict_cache(max_cache_bytes)
+
+def populated_collection(key):
+    try:
+        with open(_populated_path(key)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def record_populated(key, collection):
+    os.makedirs(cache_directory, exist_ok=True)
+    with open(_populated_path(key), "w") as file:
+        json.dump(collection, file)
+
+# Removes least recently used entries until the cache fits in max_bytes
+def evict_cache(max_bytes=max_cache_bytes):
+    if not os.path.isdir(cache_directory):
+        return
+    entries = []
+    for name in os.listdir(cache_directory):
+        path = os.path.join(cache_directory, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_bytes <= max_bytes:
+            break
+        os.remove(path)
+        total_bytes -= size
+
+# Drops one cached result, or the whole cache when no key is given
+def invalidate_cache(key=None):
+    if key is not None:
+        for path in (_cache_path(key), _populated_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+        return
+    if os.path.isdir(cache_directory):
+        for name in os.listdir(cache_directory):
+            os.remove(os.path.join(cache_directory, name))
+
+# Same as clean_data but returns the cached frame when the inputs and parameters have not
+# changed. A hit skips the prepared data write. The Mongo write is skipped too when the
+# entry's documents already went to the collection we are pointed at; otherwise (another
+# database or collection, or the entry was filled before this was recorded) they are upserted
+# again, which only writes the documents whose content hash differs.
+def cached_clean_data(file_path, progress=None):
+    if progress is not None:
+        progress("Checking cache", 0.0)
+    key = cache_key(file_path)
+    cleaned_data = load_cached(key)
+    if cleaned_data is None:
+        cleaned_data = clean_data(file_path, progress=progress)
+        store_cached(key, cleaned_data)
+        record_populated(key, current_collection())
+        return cleaned_data
+
+    if populated_collection(key) != current_collection():
+        upsert_documents(get_collection(), cleaned_data.to_dict('records'),
+                         progress=None if progress is None else
+                         lambda fraction: progress("Writing to MongoDB", fraction))
+        record_populated(key, current_collection())
+    if progress is not None:
+        progress("Loaded from cache", 1.0)
+    return cleaned_data
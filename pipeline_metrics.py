@@ -0,0 +1,168 @@
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, memory is then only reported with trace_memory
+    resource = None
+
+# Where clean_data writes its run report, next to numerical_statistics_for_power.json
+default_report_path = "pipeline_run_report.json"
+
+def _no_progress(stage, fraction=None):
+    pass
+
+# Resident memory of this process in MB right now, read from /proc where there is one
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# Highest resident memory this process has reached so far, in MB
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+# Resets the kernel's resident memory high-water mark to the current size, so the peak read
+# afterwards belongs to what ran since. Linux only; returns False where it can't be done.
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+# Resident memory high-water mark in MB since the last reset_peak_rss (VmHWM)
+def stage_peak_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError):
+        pass
+    return None
+
+# Records wall time, CPU time, memory and row counts for each named stage of a pipeline run.
+# A stage is a with block:
+#
+#   run = PipelineRun("clean_data", progress)
+#   with run.stage("Merging", 0.3) as stage:
+#       merged = pd.merge(...)
+#       stage["rows"] = len(merged)
+#
+# Starting a stage calls progress(name, fraction), the same callback the GUI progress bar and
+# the cancel button already use, and every finished stage is passed to each of the hooks, so
+# a caller can show or log the timings as they come in. By default memory is the process's
+# resident size, which costs a system call per stage and is cheap enough to leave on. On Linux
+# each stage's peak_rss_mb is its own high-water mark, as the mark is reset when the stage
+# starts; elsewhere it is the process's peak so far. With trace_memory=True each stage also
+# gets its exact Python allocation peak from tracemalloc, which is slower and meant for
+# profiling runs.
+class PipelineRun:
+    def __init__(self, name, progress=None, hooks=(), trace_memory=False):
+        self.name = name
+        self.progress = progress or _no_progress
+        self.hooks = list(hooks)
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.status = "running"
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        self._start_cpu = time.process_time()
+        # Resetting the high-water mark for a stage also resets ru_maxrss, so the run's own peak
+        # is kept here from the stage peaks
+        self._peak_rss = None
+
+    def stage(self, name, fraction=None):
+        return _Stage(self, name, fraction)
+
+    def peak_rss(self):
+        peaks = [peak for peak in (self._peak_rss, peak_rss_mb()) if peak is not None]
+        return max(peaks) if peaks else None
+
+    def _record_peak(self, peak):
+        if peak is not None and (self._peak_rss is None or peak > self._peak_rss):
+            self._peak_rss = peak
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def _finished(self, record):
+        self.stages.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+    def report(self, **extra):
+        report = {
+            "pipeline": self.name,
+            "started": self.started,
+            "status": self.status,
+            "wall_seconds": round(time.perf_counter() - self._start, 4),
+            "cpu_seconds": round(time.process_time() - self._start_cpu, 4),
+            "peak_rss_mb": _round(self.peak_rss()),
+            "stages": self.stages,
+        }
+        report.update(extra)
+        return report
+
+    # Marks the run finished (or failed) and writes the report as JSON. Returns the report.
+    def finish(self, status="completed", path=default_report_path, **extra):
+        self.status = status
+        report = self.report(**extra)
+        if path is not None:
+            with open(path, "w") as report_file:
+                json.dump(report, report_file, indent=4, default=str)
+        return report
+
+class _Stage:
+    def __init__(self, run, name, fraction):
+        self.run = run
+        self.record = {"stage": name, "rows": None}
+        self.fraction = fraction
+
+    def __enter__(self):
+        self.run.progress(self.record["stage"], self.fraction)
+        # The process peak up to now is kept before the reset wipes it
+        self.run._record_peak(peak_rss_mb())
+        self._stage_peak = reset_peak_rss()
+        self._rss = current_rss_mb()
+        self._tracing = self.run.trace_memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        elif self.run.trace_memory:
+            tracemalloc.reset_peak()
+        self._cpu = time.process_time()
+        self._start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, traceback):
+        record = self.record
+        record["wall_seconds"] = round(time.perf_counter() - self._start, 4)
+        record["cpu_seconds"] = round(time.process_time() - self._cpu, 4)
+        rss = current_rss_mb()
+        record["rss_change_mb"] = _round(rss - self._rss) if rss is not None and self._rss is not None else None
+        peak = stage_peak_rss_mb() if self._stage_peak else peak_rss_mb()
+        self.run._record_peak(peak)
+        record["peak_rss_mb"] = _round(peak)
+        if self.run.trace_memory:
+            record["traced_peak_mb"] = _round(tracemalloc.get_traced_memory()[1] / 2**20)
+            if self._tracing:
+                tracemalloc.stop()
+        record["status"] = "completed" if exc_type is None else exc_type.__name__
+        self.run._finished(record)
+        return False
+
+def _round(value):
+    return None if value is None else round(value, 2)
@@ -0,0 +1,220 @@
+import math
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from data_processing import multiplexes
+from dataset_cache import LRUCache, dataset_version as _fingerprint
+
+# Query engine for interactive filtering of the cleaned data, e.g. "Year >= 2005 and Site
+# Height > 120 and Multiplex in C18A/C18F/C188" every time a slider moves.
+#
+# Each numeric column below gets a sorted index (the row positions in value order), so a
+# range predicate is two binary searches and a slice. Multiplex gets one packed bitmap per
+# value, so membership is an OR of bitmaps. A conjunction is answered by intersecting the
+# hits: when the most selective predicate only matches a few rows the others are checked on
+# just those rows, otherwise every predicate becomes a bitmap and they are ANDed together.
+# Results are kept in an LRU cache keyed by the dataset version and the predicates.
+range_index_columns = ['Year', 'Site Height', 'Aerial height (m)', 'Power (kW)']
+bitmap_index_columns = ['Multiplex']
+
+# low/high of None leave that side open, e.g. Range(2001) is ">= 2001" and
+# Range(75, low_inclusive=False) is "> 75"
+Range = namedtuple('Range', ['low', 'high', 'low_inclusive', 'high_inclusive'], defaults=(None, None, True, True))
+
+# Below this fraction of the rows, the other predicates are checked row by row on the hits
+# of the most selective one instead of building a bitmap for each
+selective_fraction = 1 / 64
+
+max_cached_results = 256
+max_cached_engines = 4
+
+class _SortedIndex:
+    def __init__(self, values):
+        values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+        self.values = values
+        # NaNs sort to the end and are never returned by a range
+        self.order = np.argsort(values, kind='stable')
+        self.valid = int((~np.isnan(values)).sum())
+        self.sorted_values = values[self.order[:self.valid]]
+
+    def bounds(self, predicate):
+        low, high = 0, self.valid
+        if predicate.low is not None:
+            low = int(np.searchsorted(self.sorted_values, predicate.low,
+                                      side='left' if predicate.low_inclusive else 'right'))
+        if predicate.high is not None:
+            high = int(np.searchsorted(self.sorted_values, predicate.high,
+                                       side='right' if predicate.high_inclusive else 'left'))
+        return low, max(low, high)
+
+    def hits(self, predicate):
+        low, high = self.bounds(predicate)
+        return self.order[low:high]
+
+    def matches(self, predicate, positions):
+        values = self.values[positions]
+        keep = ~np.isnan(values)
+        if predicate.low is not None:
+            keep &= values >= predicate.low if predicate.low_inclusive else values > predicate.low
+        if predicate.high is not None:
+            keep &= values <= predicate.high if predicate.high_inclusive else values < predicate.high
+        return keep
+
+class _BitmapIndex:
+    def __init__(self, values, size):
+        codes, categories = pd.factorize(pd.Series(values), sort=True)
+        self.size = size
+        self.bitmaps = {}
+        self.counts = {}
+        order = np.argsort(codes, kind='stable')
+        boundaries = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+        for code, category in enumerate(categories):
+            mask = np.zeros(size, dtype=bool)
+            mask[order[boundaries[code]:boundaries[code + 1]]] = True
+            self.bitmaps[category] = np.packbits(mask)
+            self.counts[category] = int(boundaries[code + 1] - boundaries[code])
+
+    def count(self, members):
+        return sum(self.counts.get(member, 0) for member in members)
+
+    def bitmap(self, members):
+        result = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for member in members:
+            if member in self.bitmaps:
+                result |= self.bitmaps[member]
+        return result
+
+    def matches(self, members, positions):
+        bitmap = self.bitmap(members)
+        return ((bitmap[positions >> 3] >> (7 - (positions & 7))) & 1).astype(bool)
+
+class QueryEngine:
+    def __init__(self, df, version=None, range_columns=range_index_columns, bitmap_columns=bitmap_index_columns):
+        self.df = df
+        self.size = len(df)
+        self.version = version if version is not None else dataset_version(df)
+        self.ranges = {column: _SortedIndex(df[column]) for column in range_columns if column in df}
+        self.bitmaps = {column: _BitmapIndex(df[column], self.size) for column in bitmap_columns if column in df}
+
+    # predicates maps a column to a Range, or to a list/set of values for a bitmap column.
+    # Returns the matching row positions in ascending order.
+    def select(self, predicates):
+        key = (self.version, predicate_key(predicates))
+        if key in _results:
+            return _results.get(key)
+        return _cache_result(key, self._select(predicates))
+
+    def _select(self, predicates):
+        if not predicates:
+            return np.arange(self.size)
+        # Most selective first, its hit count is known without touching the rows
+        estimates = sorted((self._estimate(column, predicate), column) for column, predicate in predicates.items())
+        smallest, first = estimates[0]
+        if smallest <= self.size * selective_fraction:
+            positions = np.sort(self._hits(first, predicates[first]))
+            for _, column in estimates[1:]:
+                positions = positions[self._index(column).matches(predicates[column], positions)]
+            return positions
+
+        result = None
+        for _, column in estimates:
+            bitmap = self._bitmap(column, predicates[column])
+            result = bitmap if result is None else result & bitmap
+        return np.flatnonzero(np.unpackbits(result, count=self.size))
+
+    def _index(self, column):
+        if column in self.ranges:
+            return self.ranges[column]
+        if column in self.bitmaps:
+            return self.bitmaps[column]
+        raise KeyError(f"No index on {column!r}")
+
+    def _estimate(self, column, predicate):
+        if column in self.bitmaps:
+            return self.bitmaps[column].count(predicate)
+        low, high = self._index(column).bounds(predicate)
+        return high - low
+
+    def _hits(self, column, predicate):
+        if column in self.bitmaps:
+            return np.flatnonzero(np.unpackbits(self.bitmaps[column].bitmap(predicate), count=self.size))
+        return self._index(column).hits(predicate)
+
+    def _bitmap(self, column, predicate):
+        if column in self.bitmaps:
+            return self.bitmaps[column].bitmap(predicate)
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self._index(column).hits(predicate)] = True
+        return np.packbits(mask)
+
+    def count(self, predicates):
+        return len(self.select(predicates))
+
+    def frame(self, predicates):
+        return self.df.iloc[self.select(predicates)]
+
+    # Mean, mode and median of Power (kW) over the matching rows, the same statistics
+    # printStats gives. The Power index already holds the values in sorted order, so this
+    # only picks out the selected ones, there is no filtering or sorting of the frame.
+    def power_stats(self, predicates, column='Power (kW)'):
+        key = (self.version, predicate_key(predicates), 'stats', column)
+        if key in _results:
+            return _results.get(key)
+        index = self.ranges[column]
+        selected = np.zeros(self.size, dtype=bool)
+        selected[self.select(predicates)] = True
+        values = index.sorted_values[selected[index.order[:index.valid]]]
+        return _cache_result(key, sorted_value_stats(values))
+
+# Mean, mode (ties to the smallest value) and median of already sorted values
+def sorted_value_stats(values):
+    if values.size == 0:
+        return {"Mean": math.nan, "Mode": math.nan, "Median": math.nan}
+    run_starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    run_lengths = np.diff(np.r_[run_starts, values.size])
+    middle = (values.size - 1) // 2
+    median = values[middle] if values.size % 2 else (values[middle] + values[middle + 1]) / 2
+    return {
+        "Mean": float(values.sum() / values.size),
+        "Mode": float(values[run_starts[np.argmax(run_lengths)]]),
+        "Median": float(median),
+    }
+
+# A hashable form of the predicates, the same whatever order they were given in
+def predicate_key(predicates):
+    key = []
+    for column in sorted(predicates):
+        predicate = predicates[column]
+        if isinstance(predicate, Range):
+            key.append((column, 'range', tuple(predicate)))
+        else:
+            key.append((column, 'in', tuple(sorted(predicate))))
+    return tuple(key)
+
+# The rows printStats keeps (see filter_for_stats), narrowed further by a minimum year and a
+# minimum site height, as the GUI's filter entries do
+def stats_filter_predicates(min_year=None, min_height=None):
+    return {
+        'Year': Range(2001 if min_year is None else max(min_year, 2001)),
+        'Site Height': Range(75 if min_height is None else max(min_height, 75), low_inclusive=False),
+        'Multiplex': list(multiplexes),
+    }
+
+# Results and engines from every dataset share these, keyed by dataset version
+_results = LRUCache(max_cached_results)
+_engines = LRUCache(max_cached_engines)
+
+def _cache_result(key, result):
+    # Handed out to every caller that asks the same question, so nobody may change it
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    return _results.put(key, result)
+
+# A fingerprint of the id and indexed columns, used when no dataset version is given
+def dataset_version(df):
+    return _fingerprint(df, ['id'] + range_index_columns + bitmap_index_columns)
+
+# The query engine for a dataset, built once per version (see dataset_cache.py)
+def query_engine_for(df, version=None):
+    key = version if version is not None else dataset_version(df)
+    return _engines.get_or_build(key, lambda: QueryEngine(df, key))
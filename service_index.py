@@ -0,0 +1,115 @@
+import re
+import numpy as np
+import pandas as pd
+
+# TxParamsDAB.csv lists each transmitter's services as 32 'Serv Label N / SId N (Hex) /
+# LSN N (Hex)' column triplets and 15 'Data Serv Label N / Data SId N (Hex)' pairs, so
+# finding a service means scanning ~150 mostly empty columns. Here they are turned into one
+# long table, one row per (transmitter, service), with categorical labels and SIds decoded
+# from hex to integers, plus an inverted index from label or SId to transmitter ids.
+audio_slots = ('audio', 'Serv Label{}', 'SId {} (Hex)', 'LSN {} (Hex)')
+data_slots = ('data', 'Data Serv Label{}', 'Data SId {} (Hex)', None)
+
+def service_table(df):
+    # The params file pads some headers with a trailing space
+    columns = {column.strip(): column for column in df.columns}
+    ids = df['id'].to_numpy()
+    multiplex = df['Multiplex'].to_numpy(dtype=object) if 'Multiplex' in df else np.full(len(df), None, dtype=object)
+
+    parts = []
+    for kind, label_name, sid_name, lsn_name in (audio_slots, data_slots):
+        # Every slot number the frame has a label column for. A projected fetch may only
+        # carry some of them, e.g. 1-4 and 10, so the numbers are read off the columns
+        # rather than counted up from 1.
+        pattern = re.compile(re.escape(label_name).replace(re.escape('{}'), r'(\d+)'))
+        slots = sorted(int(match.group(1)) for match in map(pattern.fullmatch, columns) if match)
+        for slot in slots:
+            labels = df[columns[label_name.format(slot)]]
+            present = labels.notna().to_numpy()
+            if present.any():
+                def column_values(name):
+                    if name is None or name.format(slot) not in columns:
+                        return np.full(present.sum(), None, dtype=object)
+                    return df[columns[name.format(slot)]].to_numpy(dtype=object)[present]
+                parts.append(pd.DataFrame({
+                    'id': ids[present],
+                    'Multiplex': multiplex[present],
+                    'kind': kind,
+                    'slot': slot,
+                    'label': labels.to_numpy(dtype=object)[present],
+                    'sid_hex': column_values(sid_name),
+                    'lsn': column_values(lsn_name),
+                }))
+
+    if not parts:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in (
+            ('id', 'int64'), ('Multiplex', 'category'), ('kind', 'category'), ('slot', 'int8'),
+            ('label', 'category'), ('sid', 'Int64'), ('lsn', 'category'))})
+
+    table = pd.concat(parts, ignore_index=True)
+    table['label'] = table['label'].astype(str).str.strip().astype('category')
+    for column in ('Multiplex', 'kind', 'lsn'):
+        table[column] = table[column].astype('category')
+    table['slot'] = table['slot'].astype(np.int8)
+
+    # Decode each distinct hex SId once and map the rest through the category codes
+    sid_hex = table.pop('sid_hex').astype('category')
+    decoded = pd.array([int(str(value).strip(), 16) for value in sid_hex.cat.categories] + [pd.NA], dtype='Int64')
+    table['sid'] = decoded[sid_hex.cat.codes.to_numpy()]
+    return table[['id', 'Multiplex', 'kind', 'slot', 'label', 'sid', 'lsn']]
+
+class ServiceIndex:
+    def __init__(self, table):
+        self.table = table
+        ids = table['id'].to_numpy()
+        # Positions per label and per SId, turned into arrays of transmitter ids up front so
+        # a lookup is a dictionary hit plus the size of its answer
+        self._by_label = {label: np.unique(ids[positions])
+                          for label, positions in table.groupby('label', observed=True).indices.items()}
+        self._by_sid = {int(sid): np.unique(ids[positions])
+                        for sid, positions in table.dropna(subset=['sid']).groupby('sid').indices.items()}
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(service_table(df))
+
+    # Shared rather than copied when pandas copies the frame attrs it is attached to
+    def __deepcopy__(self, memo):
+        return self
+
+    # Transmitter ids carrying a service, e.g. sites_for_label('talkSPORT 2')
+    def sites_for_label(self, label):
+        return self._by_label.get(label.strip(), np.empty(0, dtype=self.table['id'].dtype))
+
+    # sid is an integer or a hex string such as 'C1D8'
+    def sites_for_sid(self, sid):
+        if isinstance(sid, str):
+            sid = int(sid.strip(), 16)
+        return self._by_sid.get(int(sid), np.empty(0, dtype=self.table['id'].dtype))
+
+    def labels(self):
+        return list(self._by_label)
+
+    def restricted_to(self, ids):
+        return ServiceIndex(self.table[self.table['id'].isin(ids)].reset_index(drop=True))
+
+    # How many transmitters of each multiplex have each audio service slot filled, e.g.
+    # slot_counts(['C18A'], [1, 2]) gives a 'Serv Label1'/'Serv Label2' column per multiplex
+    def slot_counts(self, multiplexes, slots, kind='audio'):
+        selected = self.table[(self.table['kind'] == kind) & self.table['slot'].isin(slots)]
+        counts = selected.groupby(['Multiplex', 'slot'], observed=True).size().unstack(fill_value=0)
+        counts = counts.reindex(index=list(multiplexes), columns=list(slots), fill_value=0).fillna(0).astype(int)
+        prefix = 'Serv Label' if kind == 'audio' else 'Data Serv Label'
+        counts.columns = [f'{prefix}{slot}' for slot in slots]
+        return counts
+
+# The service index for a cleaned frame. clean_data attaches one to the frame's attrs; a
+# filtered frame gets it cut down to its own ids, and a frame without one has it built.
+def service_index(df):
+    index = df.attrs.get('service_index')
+    if index is None:
+        return ServiceIndex.from_frame(df)
+    ids = df['id'].to_numpy()
+    if len(index.table) and not np.isin(index.table['id'].to_numpy(), ids).all():
+        return index.restricted_to(ids)
+    return index
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from data_processing import clean_data
+from data_storage import save_prepared_data, load_prepared_data
+from pipeline_cache import cache_key
+from service_index import service_table
+
+# History of the Ofcom DAB files over time. Each published Antenna/Params pair is cleaned
+# once, in a pool of worker processes (one snapshot per worker), stored under its date, and
+# compared with the snapshot before it. The per-id differences are stored too, so "what
+# changed this month" only reads the small diff files instead of cleaning everything again.
+#
+#   python snapshot_history.py --snapshots ofcom_downloads --history .dab_history
+#   python snapshot_history.py --history .dab_history --changes 2024-05
+#
+# A snapshot is a pair of CSVs with the same date somewhere in their path, either a dated
+# folder (2024-05-01/TxAntennaDAB.csv) or a date in the file names
+# (TxAntennaDAB_2024-05-01.csv, TxParamsDAB_20240501.csv). Dates may leave out the day.
+default_history_directory = ".dab_history"
+
+# Columns compared between snapshots, besides the services
+power_column = 'Power (kW)'
+height_columns = ['Site Height', 'Aerial height (m)']
+# Carried into the diffs so a change can be read without opening the snapshot
+context_columns = ['Site', 'Multiplex', 'Ensemble']
+
+date_pattern = re.compile(r'(\d{4})-?(\d{2})(?:-?(\d{2}))?(?!\d)')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest dated DAB snapshots and diff them.")
+    parser.add_argument("--snapshots", help="Directory of dated Antenna/Params CSV pairs to ingest")
+    parser.add_argument("--history", default=default_history_directory, help="Where snapshots and diffs are stored")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--changes", help="Print what changed in a period, e.g. 2024-05 or 2024")
+    return parser.parse_args(argv)
+
+def snapshot_date(path):
+    match = None
+    for match in date_pattern.finditer(path):
+        pass
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    return f"{year}-{month}-{day or '01'}"
+
+# Finds the snapshot pairs under directory, as {date: {"Antenna": path, "Params": path}}
+def find_snapshots(directory):
+    found = {}
+    for folder, _, names in os.walk(directory):
+        for name in names:
+            if not name.lower().endswith('.csv'):
+                continue
+            path = os.path.join(folder, name)
+            kind = "Antenna" if "antenna" in name.lower() else "Params" if "params" in name.lower() else None
+            date = snapshot_date(os.path.relpath(path, directory))
+            if kind and date:
+                found.setdefault(date, {})[kind] = path
+    return {date: pair for date, pair in sorted(found.items()) if len(pair) == 2}
+
+# Runs in a worker process
+def _clean_snapshot(date, file_path, snapshot_path):
+    cleaned = clean_data(file_path, output_path=snapshot_path, use_mongo=False, report_path=None)
+    return date, len(cleaned)
+
+def _diff_snapshots(before_date, before_path, after_date, after_path, diff_path):
+    before = load_prepared_data(before_path)
+    after = load_prepared_data(after_path)
+    diff = diff_snapshots(before, after)
+    diff.insert(0, 'from_date', before_date)
+    diff.insert(1, 'to_date', after_date)
+    save_prepared_data(diff, diff_path)
+    return after_date, len(diff)
+
+# Per-id differences between two cleaned snapshots, one row per id that was added, removed
+# or had its power, heights or services changed, with the values before and after
+def diff_snapshots(before, after):
+    compared = [power_column] + height_columns
+    before_side = _comparable(before, compared)
+    after_side = _comparable(after, compared)
+    joined = before_side.join(after_side, how='outer', lsuffix=' before', rsuffix=' after')
+
+    in_before = joined.index.isin(before_side.index)
+    in_after = joined.index.isin(after_side.index)
+    both = in_before & in_after
+
+    def changed(column):
+        old, new = joined[f'{column} before'], joined[f'{column} after']
+        return both & ~((old == new) | (old.isna() & new.isna())).to_numpy()
+
+    flags = pd.DataFrame({
+        'added': ~in_before,
+        'removed': ~in_after,
+        'power_changed': changed(power_column),
+        'height_changed': np.logical_or.reduce([changed(column) for column in height_columns]),
+        'services_changed': changed('services_hash'),
+    }, index=joined.index)
+    keep = flags.any(axis=1).to_numpy()
+    result = pd.concat([flags[keep], joined[keep]], axis=1)
+
+    # The readable service lists are only worked out for the rows that are kept
+    ids = result.index.to_numpy()
+    result['Services before'] = _service_lists(before, ids).reindex(ids).to_numpy()
+    result['Services after'] = _service_lists(after, ids).reindex(ids).to_numpy()
+    result = result.drop(columns=['services_hash before', 'services_hash after'])
+    for column in context_columns:
+        if f'{column} before' in result:
+            result[column] = result[f'{column} after'].where(result[f'{column} after'].notna(), result[f'{column} before'])
+            result = result.drop(columns=[f'{column} before', f'{column} after'])
+    return result.rename_axis('id').reset_index()
+
+# The compared columns by id, plus an order-independent hash of each id's set of services so
+# the services are compared without building a list for every transmitter
+def _comparable(df, compared):
+    columns = [column for column in compared + context_columns if column in df]
+    side = df.set_index('id')[columns].copy()
+    for column in context_columns:
+        if column in side:
+            side[column] = side[column].astype(object)
+    table = service_table(df)
+    hashes = pd.util.hash_array(table['label'].astype(str).to_numpy(dtype=object))
+    service_hash = pd.Series(hashes, index=table['id'].to_numpy()).groupby(level=0).sum()
+    side['services_hash'] = service_hash.reindex(side.index, fill_value=0).to_numpy(dtype=np.uint64)
+    return side
+
+def _service_lists(df, ids):
+    table = service_table(df[df['id'].isin(ids)])
+    labels = table.sort_values(['id', 'label'])[['id', 'label']].astype({'label': str})
+    return labels.groupby('id')['label'].agg(' | '.join)
+
+class SnapshotHistory:
+    def __init__(self, directory=default_history_directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        else:
+            self.manifest = {"snapshots": {}, "diffs": {}}
+
+    def snapshot_path(self, date):
+        return os.path.join(self.directory, "snapshots", f"{date}.arrow")
+
+    def diff_path(self, date):
+        return os.path.join(self.directory, "diffs", f"{date}.arrow")
+
+    def dates(self):
+        return sorted(self.manifest["snapshots"])
+
+    def _save_manifest(self):
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=4, sort_keys=True)
+
+    # Cleans every snapshot in snapshots ({date: file_path}, e.g. from find_snapshots) that is
+    # new or whose files changed since it was stored, then rebuilds the diffs that depend on
+    # them. Returns the dates that were (re)cleaned.
+    def ingest(self, snapshots, workers=None):
+        os.makedirs(os.path.join(self.directory, "snapshots"), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, "diffs"), exist_ok=True)
+        keys = {date: cache_key(file_path) for date, file_path in snapshots.items()}
+        pending = {date: file_path for date, file_path in snapshots.items()
+                   if self.manifest["snapshots"].get(date, {}).get("key") != keys[date]}
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            cleaned = pool.map(_clean_snapshot, list(pending), list(pending.values()),
+                               [self.snapshot_path(date) for date in pending])
+            for date, rows in cleaned:
+                self.manifest["snapshots"][date] = {"key": keys[date], "rows": rows,
+                                                    "files": snapshots[date]}
+            self._save_manifest()
+
+            # A diff is stale when either of its snapshots changed or its predecessor is new
+            dates = self.dates()
+            pairs = [(before, after) for before, after in zip(dates, dates[1:])
+                     if before in pending or after in pending
+                     or self.manifest["diffs"].get(after, {}).get("from_date") != before]
+            diffed = pool.map(_diff_snapshots,
+                              [before for before, _ in pairs], [self.snapshot_path(before) for before, _ in pairs],
+                              [after for _, after in pairs], [self.snapshot_path(after) for _, after in pairs],
+                              [self.diff_path(after) for _, after in pairs])
+            for (before, _), (after, changes) in zip(pairs, diffed):
+                self.manifest["diffs"][after] = {"from_date": before, "changes": changes}
+        self._save_manifest()
+        return sorted(pending)
+
+    def snapshot(self, date, columns=None):
+        return load_prepared_data(self.snapshot_path(date), columns)
+
+    # Everything that changed in snapshots dated in [start, end), from the stored diffs.
+    # period is a shorthand for a whole year or month: "2024" or "2024-05".
+    def changes(self, start=None, end=None, period=None):
+        if period is not None:
+            start, end = _period_bounds(period)
+        dates = [date for date in sorted(self.manifest["diffs"])
+                 if (start is None or date >= start) and (end is None or date < end)]
+        diffs = [load_prepared_data(self.diff_path(date)) for date in dates]
+        return pd.concat(diffs, ignore_index=True) if diffs else pd.DataFrame()
+
+    # The history of one transmitter: every stored diff row for its id
+    def changes_for_id(self, transmitter_id):
+        diffs = [load_prepared_data(self.diff_path(date)) for date in sorted(self.manifest["diffs"])]
+        rows = [diff[diff['id'] == transmitter_id] for diff in diffs]
+        return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+
+def _period_bounds(period):
+    parts = [int(part) for part in period.split("-")]
+    if len(parts) == 1:
+        return f"{parts[0]:04d}-01-01", f"{parts[0] + 1:04d}-01-01"
+    year, month = parts[:2]
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01", f"{next_year:04d}-{next_month:02d}-01"
+
+def summarise_changes(changes):
+    flags = ['added', 'removed', 'power_changed', 'height_changed', 'services_changed']
+    return {flag: int(changes[flag].sum()) if flag in changes else 0 for flag in flags}
+
+if __name__ == "__main__":
+    args = parse_args()
+    history = SnapshotHistory(args.history)
+    if args.snapshots:
+        ingested = history.ingest(find_snapshots(args.snapshots), args.workers)
+        print(f"Ingested {len(ingested)} snapshot(s): {', '.join(ingested) or 'none new'}")
+    if args.changes:
+        print(json.dumps(summarise_changes(history.changes(period=args.changes)), indent=4))
@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+from dataset_cache import LRUCache, dataset_version as _fingerprint
+
+# Spatial index over the transmitters' Lat/Long, for "which sites are within 30 km of here"
+# and "the nearest five C18A sites" without scanning the whole frame for every question.
+#
+# Points are placed on a uniform grid of cubes over their 3D position on the Earth's
+# surface, so there is no projection distortion anywhere in the country. A query only
+# looks at the cubes that can hold an answer, and the candidates from those are refined
+# with the exact haversine distance in one vectorised step.
+earth_radius_km = 6371.0088
+default_cell_km = 10.0
+
+# Each cube coordinate is packed into 21 bits of one int64 key, so a cube can't be smaller
+# than the Earth's radius over 2**20, about 6 m
+_cell_bits = 21
+_cell_offset = 1 << (_cell_bits - 1)
+min_cell_km = earth_radius_km / (_cell_offset - 1)
+# Most (query, cube) pairs looked up at once, and most query points answered together, which
+# bound the memory a batch query needs besides its result
+max_cube_lookups = 1 << 20
+query_block = 256
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _to_xyz(lat, lon):
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return earth_radius_km * np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+class SpatialIndex:
+    def __init__(self, df, cell_km=default_cell_km):
+        if not cell_km >= min_cell_km or not np.isfinite(cell_km):
+            raise ValueError(f"cell_km must be a finite number of at least {min_cell_km:.4f} km, got {cell_km!r}")
+        lat = pd.to_numeric(df['Lat'], errors='coerce').to_numpy(dtype=float)
+        lon = pd.to_numeric(df['Long'], errors='coerce').to_numpy(dtype=float)
+        # Rows without coordinates can't be found by location so they are left out
+        located = ~(np.isnan(lat) | np.isnan(lon))
+        self.cell_km = cell_km
+        self.ids = df['id'].to_numpy()[located]
+        self.lat = lat[located]
+        self.lon = lon[located]
+        multiplex = df['Multiplex'] if 'Multiplex' in df else pd.Series(None, index=df.index)
+        self.multiplex = multiplex.to_numpy(dtype=object)[located]
+
+        # No point can be in a cube outside these, so search boxes are clipped to them
+        self._cell_min = int(np.floor(-earth_radius_km / cell_km))
+        self._cell_max = int(np.floor(earth_radius_km / cell_km))
+        self._xyz = _to_xyz(self.lat, self.lon)
+        cells = np.floor(self._xyz / cell_km).astype(np.int64)
+        keys = self._cell_keys(cells)
+        self._order = np.argsort(keys, kind='stable')
+        self._cell_ids, starts = np.unique(keys[self._order], return_index=True)
+        self._cell_coords = cells[self._order[starts]]
+        self._cell_starts = starts
+        self._cell_ends = np.append(starts[1:], len(keys))
+
+    # One int64 per cube, which can't collide as cell_km is at least min_cell_km
+    @staticmethod
+    def _cell_keys(cells):
+        return (((cells[..., 0] + _cell_offset) << (2 * _cell_bits)) | ((cells[..., 1] + _cell_offset) << _cell_bits)
+                | (cells[..., 2] + _cell_offset))
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Every (query, row) pair where the row is in a cube that could be within radius_km of
+    # the query point, for all the query points at once. Returns the query positions and the
+    # row positions, grouped by query in ascending order.
+    def _candidates(self, points_xyz, radius_km):
+        points_xyz = np.atleast_2d(points_xyz)
+        # The straight-line (chord) distance is never more than the distance along the surface
+        chord = 2 * earth_radius_km * np.sin(min(radius_km, np.pi * earth_radius_km) / (2 * earth_radius_km))
+        low = np.clip(np.floor((points_xyz - chord) / self.cell_km), self._cell_min, self._cell_max).astype(np.int64)
+        high = np.clip(np.floor((points_xyz + chord) / self.cell_km), self._cell_min, self._cell_max).astype(np.int64)
+        # A small search box is looked up cube by cube. When it covers more cubes than are
+        # occupied, the occupied cubes are checked against the box instead.
+        scanned = np.prod(high - low + 1, axis=1) > len(self._cell_ids)
+        boxed = np.flatnonzero(~scanned)
+        scanned = np.flatnonzero(scanned)
+
+        queries, cell_positions = [], []
+        if boxed.size:
+            # The box of every query has (almost) the same size, so one grid of cube offsets
+            # serves them all and the cubes past a query's own box are masked out
+            spans = (high[boxed] - low[boxed]).max(axis=0) + 1
+            offsets = np.stack(np.meshgrid(*[np.arange(span) for span in spans], indexing='ij'), axis=-1).reshape(-1, 3)
+            block = max(1, max_cube_lookups // len(offsets))
+            for start in range(0, boxed.size, block):
+                chunk = boxed[start:start + block]
+                cubes = low[chunk, None, :] + offsets[None, :, :]
+                inside = (cubes <= high[chunk, None, :]).all(axis=-1)
+                keys = self._cell_keys(cubes)
+                positions = np.minimum(np.searchsorted(self._cell_ids, keys), len(self._cell_ids) - 1)
+                # Only the cubes that actually hold points
+                query_of, cube_of = np.nonzero(inside & (self._cell_ids[positions] == keys))
+                queries.append(chunk[query_of])
+                cell_positions.append(positions[query_of, cube_of])
+        if scanned.size and len(self._cell_ids):
+            block = max(1, max_cube_lookups // len(self._cell_ids))
+            for start in range(0, scanned.size, block):
+                chunk = scanned[start:start + block]
+                inside = ((self._cell_coords[None, :, :] >= low[chunk, None, :]) &
+                          (self._cell_coords[None, :, :] <= high[chunk, None, :])).all(axis=-1)
+                query_of, cell_of = np.nonzero(inside)
+                queries.append(chunk[query_of])
+                cell_positions.append(cell_of)
+        if not queries:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        queries, rows = self._cube_rows(np.concatenate(queries), np.concatenate(cell_positions))
+        # Points in the right cubes can still be too far away in a straight line
+        near = ((self._xyz[rows] - points_xyz[queries]) ** 2).sum(axis=1) <= chord * chord * (1 + 1e-9)
+        queries, rows = queries[near], rows[near]
+        order = np.argsort(queries, kind='stable')
+        return queries[order], rows[order]
+
+    # Expands each (query, occupied cube) pair into one pair per point in the cube
+    def _cube_rows(self, queries, cell_positions):
+        starts = self._cell_starts[cell_positions]
+        counts = self._cell_ends[cell_positions] - starts
+        total = int(counts.sum())
+        firsts = np.cumsum(counts) - counts
+        flat = np.arange(total) - np.repeat(firsts - starts, counts)
+        return np.repeat(queries, counts), self._order[flat]
+
+    def _filter(self, queries, candidates, multiplexes):
+        if multiplexes is None:
+            return queries, candidates
+        keep = np.isin(self.multiplex[candidates], list(multiplexes))
+        return queries[keep], candidates[keep]
+
+    def _result(self, rows, distances):
+        return pd.DataFrame({
+            'id': self.ids[rows],
+            'Multiplex': self.multiplex[rows],
+            'Lat': self.lat[rows],
+            'Long': self.lon[rows],
+            'distance_km': distances,
+        })
+
+    def _batch_result(self, queries, rows, distances):
+        result = self._result(rows, distances)
+        result.insert(0, 'query', queries)
+        return result
+
+    # Every transmitter within radius_km of the point, nearest first
+    def within_radius(self, lat, lon, radius_km, multiplexes=None):
+        _, rows, distances = self._within_radius_rows([lat], [lon], radius_km, multiplexes)
+        return self._result(rows, distances)
+
+    def _within_radius_rows(self, lats, lons, radius_km, multiplexes):
+        lats, lons = np.atleast_1d(np.asarray(lats, dtype=float)), np.atleast_1d(np.asarray(lons, dtype=float))
+        queries, candidates = self._filter(*self._candidates(_to_xyz(lats, lons), radius_km), multiplexes)
+        distances = haversine_km(lats[queries], lons[queries], self.lat[candidates], self.lon[candidates])
+        keep = distances <= radius_km
+        queries, rows, distances = queries[keep], candidates[keep], distances[keep]
+        order = np.lexsort((distances, queries))
+        return queries[order], rows[order], distances[order]
+
+    # The k nearest transmitters to the point, nearest first. The search radius starts at one
+    # cube and doubles until k points are inside it; everything inside the radius is checked,
+    # so the k found are the true nearest.
+    def nearest(self, lat, lon, k=5, multiplexes=None):
+        _, rows, distances = self._nearest_rows([lat], [lon], k, multiplexes)
+        return self._result(rows, distances)
+
+    # All the query points are searched together, the ones that still have fewer than k
+    # points inside their radius going round again with it doubled
+    def _nearest_rows(self, lats, lons, k, multiplexes):
+        lats, lons = np.atleast_1d(np.asarray(lats, dtype=float)), np.atleast_1d(np.asarray(lons, dtype=float))
+        points = _to_xyz(lats, lons)
+        pending = np.arange(len(lats))
+        radius_km = self.cell_km
+        found = []
+        while pending.size:
+            local, candidates = self._filter(*self._candidates(points[pending], radius_km), multiplexes)
+            queries = pending[local]
+            distances = haversine_km(lats[queries], lons[queries], self.lat[candidates], self.lon[candidates])
+            covers_everything = radius_km >= np.pi * earth_radius_km
+            inside = np.ones(len(distances), dtype=bool) if covers_everything else distances <= radius_km
+            done = np.bincount(local[inside], minlength=pending.size) >= k
+            if covers_everything:
+                done[:] = True
+            keep = inside & done[local]
+            queries, rows, distances = queries[keep], candidates[keep], distances[keep]
+            order = np.lexsort((distances, queries))
+            queries, rows, distances = queries[order], rows[order], distances[order]
+            # Position of each row within its query's answer, to keep the first k
+            firsts = np.searchsorted(queries, queries, side='left')
+            nearest = np.arange(len(queries)) - firsts < k
+            found.append((queries[nearest], rows[nearest], distances[nearest]))
+            pending = pending[~done]
+            radius_km *= 2
+        queries, rows, distances = (np.concatenate(parts) for parts in zip(*found)) if found else \
+            (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0))
+        order = np.argsort(queries, kind='stable')
+        return queries[order], rows[order], distances[order]
+
+    # Batch versions: one result frame for many query points, with a 'query' column giving
+    # the position of the query point each row answers. The points are looked up together,
+    # query_block of them at a time.
+    def within_radius_batch(self, lats, lons, radius_km, multiplexes=None):
+        return self._batch(lambda lats, lons: self._within_radius_rows(lats, lons, radius_km, multiplexes), lats, lons)
+
+    def nearest_batch(self, lats, lons, k=5, multiplexes=None):
+        return self._batch(lambda lats, lons: self._nearest_rows(lats, lons, k, multiplexes), lats, lons)
+
+    def _batch(self, query, lats, lons):
+        lats, lons = np.atleast_1d(np.asarray(lats, dtype=float)), np.atleast_1d(np.asarray(lons, dtype=float))
+        parts = []
+        for start in range(0, len(lats), query_block):
+            queries, rows, distances = query(lats[start:start + query_block], lons[start:start + query_block])
+            parts.append((queries + start, rows, distances))
+        if not parts:
+            return self._batch_result(np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0))
+        return self._batch_result(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+# Indexes built so far, keyed by dataset version. Only the most recent few are kept.
+max_cached_indexes = 4
+_indexes = LRUCache(max_cached_indexes)
+
+# A fingerprint of the rows the index depends on, used when no dataset version is given
+def dataset_version(df):
+    return _fingerprint(df, ['id', 'Lat', 'Long', 'Multiplex'])
+
+# The spatial index for a dataset, built once per version (see dataset_cache.py)
+def spatial_index_for(df, version=None, cell_km=default_cell_km):
+    key = (version if version is not None else dataset_version(df), cell_km)
+    return _indexes.get_or_build(key, lambda: SpatialIndex(df, cell_km))
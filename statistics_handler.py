@@ -1,21 +1,63 @@
 import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from pymongo import MongoClient
 from data_processing import multiplexes
+from database import get_collection
+from streaming_stats import StatsAccumulator
+from data_storage import iter_prepared_chunks
 
-def printStats(merged_data):
-    # Apply filters for 'Site Height' > 75 and 'Year' >= 2001
-    filtered_data = merged_data[
+# Where printStats and the other power statistics are written unless told otherwise
+default_stats_path = "numerical_statistics_for_power.json"
+
+# The only columns printStats needs, so a columnar cache can be loaded with just these
+stats_columns = ['Power (kW)', 'Site Height', 'Year', 'Multiplex']
+
+# Apply filters for 'Site Height' > 75 and 'Year' >= 2001
+def filter_for_stats(merged_data):
+    return merged_data[
         (merged_data['Site Height'] > 75) &
         (merged_data['Year'] >= 2001) &
         (merged_data['Multiplex'].isin(multiplexes))  # Filter for the multiplexes
     ]
 
+# Feeds the filtered power values into an accumulator one chunk at a time. merged_data can
+# be the whole cleaned frame or an iterable of cleaned chunks such as the one
+# stream_clean_data yields. Pass in an existing accumulator to read the running results
+# while the chunks are still arriving.
+def accumulate_power_stats(merged_data, accumulator=None):
+    if accumulator is None:
+        accumulator = StatsAccumulator()
+    chunks = [merged_data] if isinstance(merged_data, pd.DataFrame) else merged_data
+    for chunk in chunks:
+        accumulator.update(filter_for_stats(chunk)['Power (kW)'])
+    return accumulator
+
+def printStats(merged_data, output_path=default_stats_path):
+    # All three statistics come from one pass over the data, so this works the same on a
+    # frame in memory or a stream of chunks that never fits in memory
+    accumulator = accumulate_power_stats(merged_data)
+
     #Calculations here and printing to console:
-    mean_calculation = filtered_data['Power (kW)'].mean()
-    mode_calculation = filtered_data['Power (kW)'].mode()[0]  # mode() returns a series, so first element is taken
-    median_calculation = filtered_data['Power (kW)'].median()
+    mean_calculation = accumulator.mean()
+    mode_calculation = accumulator.mode()
+    median_calculation = accumulator.median()
+
+    return save_stats(mean_calculation, mode_calculation, median_calculation, output_path)
+
+# The filter_for_stats conditions as read filters (see data_storage.load_prepared_data)
+stats_filters = [('Site Height', '>', 75), ('Year', '>=', 2001), ('Multiplex', 'in', multiplexes)]
+
+# printStats straight from a prepared data file, read a chunk at a time and only the columns
+# it needs, so a file bigger than memory still works and the first chunks are counted while
+# the rest are being read. The stats filters go to the reader, so with a partitioned dataset
+# the years (and multiplexes) printStats would drop are never read at all. filters narrows
+# it further, e.g. [('Year', '>=', 2015)].
+def printStatsFromFile(path, filters=(), output_path=default_stats_path):
+    return printStats(iter_prepared_chunks(path, columns=stats_columns, filters=stats_filters + list(filters)),
+                      output_path)
 
+def save_stats(mean_calculation, mode_calculation, median_calculation, output_path=default_stats_path):
     # Prepare results dictionary
     stats_results = {
         "Power (kW) Statistics": {
@@ -32,5 +74,163 @@ def printStats(merged_data):
 
     # Save to JSON for future readability, it's better to save for future use than just to print
     #to terminal
-    with open("numerical_statistics_for_power.json", "w") as file:
-        json.dump(stats_results, file, indent=4)
\ No newline at end of file
+    with open(output_path, "w") as file:
+        json.dump(stats_results, file, indent=4)
+    return stats_results
+
+# The same filter as filter_for_stats, written as a MongoDB query. NaN power values are
+# left out as pandas skips them too.
+stats_query = {
+    "Multiplex": {"$in": multiplexes},
+    "Year": {"$gte": 2001},
+    "Site Height": {"$gt": 75},
+    "Power (kW)": {"$type": "number", "$ne": float("nan")},
+}
+
+# Compound index matching stats_query: equality on Multiplex first, then the two ranges
+def ensure_stats_indexes(collection):
+    collection.create_index([("Multiplex", 1), ("Year", 1), ("Site Height", 1)])
+
+# One aggregation pipeline that filters and works out mean, mode and median on the server.
+# The median ranks the sorted power values with $setWindowFields (MongoDB 5.0+) and averages
+# the middle one or two, so it is exact and no documents are sent back to Python.
+stats_pipeline = [
+    {"$match": stats_query},
+    {"$project": {"_id": 0, "Power (kW)": 1}},
+    {"$facet": {
+        "mean": [
+            {"$group": {"_id": None, "value": {"$avg": "$Power (kW)"}}},
+        ],
+        # Ties go to the smallest value, the same as pandas mode()[0]
+        "mode": [
+            {"$group": {"_id": "$Power (kW)", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": 1},
+        ],
+        "median": [
+            {"$setWindowFields": {
+                "sortBy": {"Power (kW)": 1},
+                "output": {
+                    "position": {"$documentNumber": {}},
+                    "total": {"$count": {}, "window": {"documents": ["unbounded", "unbounded"]}},
+                },
+            }},
+            {"$match": {"$expr": {"$or": [
+                {"$eq": ["$position", {"$ceil": {"$divide": ["$total", 2]}}]},
+                {"$eq": ["$position", {"$add": [{"$floor": {"$divide": ["$total", 2]}}, 1]}]},
+            ]}}},
+            {"$group": {"_id": None, "value": {"$avg": "$Power (kW)"}}},
+        ],
+    }},
+]
+
+# Server-side version of printStats, for when the data is already in MongoDB. It writes the
+# same numerical_statistics_for_power.json without pulling the documents into the client.
+def printStatsFromMongo(collection=None, output_path=default_stats_path):
+    if collection is None:
+        collection = get_collection()
+
+    ensure_stats_indexes(collection)
+    result = next(collection.aggregate(stats_pipeline, allowDiskUse=True))
+
+    # Each facet is empty when nothing matches the filter, which pandas reports as NaN
+    mean_calculation = result["mean"][0]["value"] if result["mean"] else float("nan")
+    mode_calculation = result["mode"][0]["_id"] if result["mode"] else float("nan")
+    median_calculation = result["median"][0]["value"] if result["median"] else float("nan")
+
+    return save_stats(mean_calculation, mode_calculation, median_calculation, output_path)
+
+# Grouped statistics: every value column summarised for every group of every group column,
+# e.g. power and height per Multiplex, per Ensemble and per Year.
+group_columns = ['Multiplex', 'Ensemble', 'Year']
+group_value_columns = ['Power (kW)', 'Site Height']
+
+# The group column is factorised once and every value column's per-group value counts come
+# from one sort of (group code, value) pairs, giving every group's accumulator at once rather
+# than filtering or grouping the frame again for each group or value column
+def _grouped_accumulators(df, group_column, value_columns):
+    codes, keys = pd.factorize(df[group_column], sort=True)
+    by_value = {}
+    for value_column in value_columns:
+        values = df[value_column].to_numpy(dtype=float, na_value=np.nan)
+        present = (codes >= 0) & ~np.isnan(values)
+        group_codes, values = codes[present], values[present]
+        order = np.lexsort((values, group_codes))
+        group_codes, values = group_codes[order], values[order]
+        # A new (group, value) pair starts wherever either changes
+        starts = np.flatnonzero(np.r_[True, (group_codes[1:] != group_codes[:-1]) | (values[1:] != values[:-1])])
+        counts = np.diff(np.r_[starts, len(values)])
+        pair_groups, pair_values = group_codes[starts], values[starts]
+        # and a new group wherever the group code changes
+        group_starts = np.flatnonzero(np.r_[True, pair_groups[1:] != pair_groups[:-1]]) if len(starts) else starts
+        group_ends = np.r_[group_starts[1:], len(starts)]
+        by_value[value_column] = {
+            keys[pair_groups[start]]: StatsAccumulator.from_value_counts(pair_values[start:end], counts[start:end])
+            for start, end in zip(group_starts, group_ends)
+        }
+    return by_value
+
+def _grouped_pass(df, group_columns, value_columns):
+    return {group_column: _grouped_accumulators(df, group_column, value_columns) for group_column in group_columns}
+
+# Worker for the process pool: the rows for one range of group keys of one group column
+def _grouped_range(df, group_column, value_columns):
+    return group_column, _grouped_accumulators(df, group_column, value_columns)
+
+def _merge_grouped(results, partial):
+    for group_column, by_value in partial.items():
+        for value_column, accumulators in by_value.items():
+            merged = results.setdefault(group_column, {}).setdefault(value_column, {})
+            for key, accumulator in accumulators.items():
+                if key in merged:
+                    merged[key].merge(accumulator)
+                else:
+                    merged[key] = accumulator
+
+# Works out grouped accumulators for a cleaned frame or an iterable of cleaned chunks. With
+# workers > 1 each group column's keys are split into that many ranges and each range is
+# summarised in its own process; the key ranges don't overlap so the results just combine.
+# The one pool is started up front and used for every chunk.
+def accumulate_grouped_stats(merged_data, group_columns=group_columns, value_columns=group_value_columns, workers=1):
+    results = {}
+    chunks = [merged_data] if isinstance(merged_data, pd.DataFrame) else merged_data
+    if workers <= 1:
+        for chunk in chunks:
+            _merge_grouped(results, _grouped_pass(chunk, group_columns, value_columns))
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunks:
+            futures = []
+            for group_column in group_columns:
+                keys = np.sort(chunk[group_column].dropna().unique())
+                for key_range in np.array_split(keys, workers):
+                    if len(key_range):
+                        subset = chunk.loc[chunk[group_column].isin(key_range), [group_column] + value_columns]
+                        futures.append(executor.submit(_grouped_range, subset, group_column, value_columns))
+            for future in futures:
+                group_column, by_value = future.result()
+                _merge_grouped(results, {group_column: by_value})
+    return results
+
+# Works out power and height statistics for every Multiplex, Ensemble and Year in one go and
+# writes them all to one structured file, instead of overwriting
+# numerical_statistics_for_power.json with a single group.
+def printGroupedStats(merged_data, workers=1, output_path="grouped_statistics.json"):
+    results = accumulate_grouped_stats(merged_data, workers=workers)
+
+    # JSON keys have to be strings, so Year groups are written as e.g. "2001"
+    grouped_results = {
+        group_column: {
+            str(key): {value_column: by_value[value_column][key].to_dict() for value_column in by_value if key in by_value[value_column]}
+            for key in sorted(set().union(*[accumulators.keys() for accumulators in by_value.values()]), key=str)
+        }
+        for group_column, by_value in results.items()
+    }
+
+    for group_column, groups in grouped_results.items():
+        print(f"{group_column}: statistics for {len(groups)} groups")
+
+    with open(output_path, "w") as file:
+        json.dump(grouped_results, file, indent=4)
+    return grouped_results
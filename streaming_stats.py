@@ -0,0 +1,201 @@
+import math
+import numpy as np
+
+# Single-pass statistics over chunks of values. Each update() only looks at the new chunk,
+# and two accumulators built on separate chunks (or in separate worker processes, they
+# pickle fine) can be merged into one that gives the same answer as a single pass over
+# all of the data. NaN values are skipped, the same as pandas does.
+#
+# Count, sum and the sum of squared deviations (for the variance) are combined with Chan's
+# parallel update. Mode and quantiles are exact while there are at most max_exact_values
+# distinct values, which covers columns like Power (kW) in the Ofcom files: the distinct
+# values and their counts are kept in two sorted numpy arrays. Past that, so the memory
+# stays bounded however many distinct values stream through (e.g. the jittered synthetic
+# data), the arrays are compressed into a t-digest of at most about `compression`
+# centroids for the quantiles, and the mode comes from a Misra-Gries summary of the
+# heavy_hitters most common values. Both sketches merge like the exact counts do, the
+# quantiles are then approximate and the mode is the most common value whenever that
+# value makes up more than 1/heavy_hitters of the data.
+max_exact_values = 50000
+compression = 200
+heavy_hitters = 1000
+
+class StatsAccumulator:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.squared_deviations = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        # Exact: the distinct values and their counts. Sketched: the t-digest centroid
+        # means and weights, with the heavy hitter candidates kept separately.
+        self.exact = True
+        self.values = np.empty(0, dtype=float)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.heavy_values = None
+        self.heavy_counts = None
+
+    # Builds an accumulator straight from distinct values and how often each one appears,
+    # e.g. the output of a grouped value count
+    @classmethod
+    def from_value_counts(cls, values, counts):
+        values = np.asarray(values, dtype=float)
+        counts = np.asarray(counts, dtype=np.int64)
+        keep = ~np.isnan(values) & (counts > 0)
+        values, counts = values[keep], counts[keep]
+
+        accumulator = cls()
+        if values.size == 0:
+            return accumulator
+        accumulator.count = int(counts.sum())
+        accumulator.total = float((values * counts).sum())
+        accumulator.squared_deviations = float((counts * (values - accumulator.total / accumulator.count) ** 2).sum())
+        accumulator.minimum = float(values.min())
+        accumulator.maximum = float(values.max())
+        accumulator.values, accumulator.counts = _combine_counts(values, counts)
+        accumulator._limit_size()
+        return accumulator
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+
+        chunk = StatsAccumulator()
+        chunk.count = int(values.size)
+        chunk.total = float(values.sum())
+        chunk.squared_deviations = float(((values - chunk.total / chunk.count) ** 2).sum())
+        chunk.minimum = float(values.min())
+        chunk.maximum = float(values.max())
+        chunk.values, chunk.counts = np.unique(values, return_counts=True)
+        chunk._limit_size()
+        return self.merge(chunk)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.squared_deviations = other.squared_deviations
+        else:
+            delta = other.total / other.count - self.total / self.count
+            combined = self.count + other.count
+            self.squared_deviations += other.squared_deviations + delta * delta * self.count * other.count / combined
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+        if self.exact and other.exact:
+            self.values, self.counts = _combine_counts(np.concatenate([self.values, other.values]),
+                                                       np.concatenate([self.counts, other.counts]))
+            self._limit_size()
+            return self
+        self._to_sketch()
+        heavy_values, heavy_counts = other._heavy_hitters()
+        self.heavy_values, self.heavy_counts = _reduce_heavy_hitters(*_combine_counts(
+            np.concatenate([self.heavy_values, heavy_values]), np.concatenate([self.heavy_counts, heavy_counts])))
+        self.values, self.counts = _compress_digest(np.concatenate([self.values, other.values]),
+                                                    np.concatenate([self.counts, other.counts]))
+        return self
+
+    def _limit_size(self):
+        if self.exact and self.values.size > max_exact_values:
+            self._to_sketch()
+
+    def _heavy_hitters(self):
+        if self.exact:
+            return _reduce_heavy_hitters(self.values, self.counts)
+        return self.heavy_values, self.heavy_counts
+
+    def _to_sketch(self):
+        if self.exact:
+            self.heavy_values, self.heavy_counts = self._heavy_hitters()
+            self.values, self.counts = _compress_digest(self.values, self.counts)
+            self.exact = False
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    # Sample variance by default, the same as pandas .var()
+    def variance(self, ddof=1):
+        return self.squared_deviations / (self.count - ddof) if self.count > ddof else math.nan
+
+    # The most common value, ties going to the smallest like pandas mode()[0]. When the
+    # sketch has no value that stands out, e.g. every value is different, that is the
+    # smallest value.
+    def mode(self):
+        if not self.count:
+            return math.nan
+        values, counts = (self.values, self.counts) if self.exact else (self.heavy_values, self.heavy_counts)
+        if values.size == 0:
+            return self.minimum
+        return float(values[np.argmax(counts)])
+
+    # The value at a 0-based position in the sorted data. Exact values are looked up in the
+    # cumulative counts; centroids stand at the middle of the positions they cover and the
+    # value is interpolated between them, the minimum and the maximum.
+    def _value_at(self, position):
+        cumulative = np.cumsum(self.counts)
+        if self.exact:
+            return float(self.values[np.searchsorted(cumulative, position, side='right')])
+        centres = cumulative - (self.counts + 1) / 2
+        return float(np.interp(position, np.r_[0, centres, self.count - 1],
+                               np.r_[self.minimum, self.values, self.maximum]))
+
+    # Quantile with linear interpolation, matching pandas .quantile(q) while exact
+    def quantile(self, q):
+        if not self.count:
+            return math.nan
+        position = q * (self.count - 1)
+        lower = math.floor(position)
+        lower_value = self._value_at(lower)
+        if position == lower:
+            return lower_value
+        upper_value = self._value_at(lower + 1)
+        return lower_value + (upper_value - lower_value) * (position - lower)
+
+    def median(self):
+        if not self.count:
+            return math.nan
+        middle = (self.count - 1) // 2
+        if self.count % 2:
+            return self._value_at(middle)
+        return (self._value_at(middle) + self._value_at(middle + 1)) / 2
+
+    def to_dict(self):
+        return {
+            "Count": self.count,
+            "Mean": self.mean(),
+            "Variance": self.variance(),
+            "Mode": self.mode(),
+            "Median": self.median(),
+        }
+
+# Sums the counts of equal values, returning the distinct values in order
+def _combine_counts(values, counts):
+    distinct, inverse = np.unique(values, return_inverse=True)
+    return distinct, np.bincount(inverse, weights=counts, minlength=distinct.size).astype(np.int64)
+
+# Merges neighbouring centroids (or exact values) into at most about compression + 1
+# centroids, small at the tails and larger in the middle (the t-digest k1 scale function)
+def _compress_digest(means, weights):
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order], weights[order]
+    middle = (np.cumsum(weights) - weights / 2) / weights.sum()
+    scale = np.floor(compression * (np.arcsin(2 * middle - 1) / math.pi + 0.5))
+    _, group = np.unique(scale, return_inverse=True)
+    merged_weights = np.bincount(group, weights=weights)
+    merged_means = np.bincount(group, weights=means * weights) / merged_weights
+    return merged_means, merged_weights.astype(np.int64)
+
+# Misra-Gries: keeps the heavy_hitters largest counts, each lowered by the next largest
+# count, so the summaries of separate chunks still merge by adding them up
+def _reduce_heavy_hitters(values, counts):
+    if values.size <= heavy_hitters:
+        return values, counts
+    order = np.lexsort((values, -counts))
+    cut = counts[order[heavy_hitters]]
+    keep = np.sort(order[:heavy_hitters])
+    values, counts = values[keep], counts[keep] - cut
+    return values[counts > 0], counts[counts > 0]
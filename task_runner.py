@@ -0,0 +1,98 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Runs long GUI jobs (cleaning, stats, database queries) on worker threads so the Tk window
+# stays responsive. Tk must only be touched from the main thread, so workers never call back
+# into the GUI directly: they put messages on a queue and the runner drains it from the Tk
+# event loop with after() polling, calling the progress/done/error callbacks there.
+
+class TaskCancelled(Exception):
+    pass
+
+# Handed to every task as its progress callback. Long-running code calls
+# progress(stage, fraction) between steps; that reports the stage to the GUI and is also
+# where a cancelled task stops, by raising TaskCancelled.
+class TaskContext:
+    def __init__(self, name, messages):
+        self.name = name
+        self._messages = messages
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def __call__(self, stage, fraction=None):
+        if self.cancelled:
+            raise TaskCancelled(f"{self.name} was cancelled")
+        self._messages.put(("progress", self.name, (stage, fraction)))
+
+class BackgroundTaskRunner:
+    def __init__(self, root, max_workers=2, poll_interval_ms=100, on_progress=None):
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+        # on_progress(name, stage, fraction) is called on the Tk thread
+        self.on_progress = on_progress
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dab-task")
+        self._messages = queue.Queue()
+        self._tasks = {}
+        self.root.after(self.poll_interval_ms, self._poll)
+
+    def is_running(self, name):
+        return name in self._tasks
+
+    # Starts func(progress) on a worker thread. Returns False without starting anything if
+    # a task with the same name is still running, so double clicks don't queue duplicates.
+    def submit(self, name, func, on_done=None, on_error=None, on_cancelled=None):
+        if name in self._tasks:
+            return False
+        context = TaskContext(name, self._messages)
+        self._tasks[name] = (context, on_done, on_error, on_cancelled)
+        self._executor.submit(self._run, context, func)
+        return True
+
+    def cancel(self, name):
+        if name in self._tasks:
+            self._tasks[name][0].cancel()
+
+    def cancel_all(self):
+        for name in list(self._tasks):
+            self.cancel(name)
+
+    def shutdown(self):
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, context, func):
+        try:
+            result = func(context)
+        except TaskCancelled:
+            self._messages.put(("cancelled", context.name, None))
+        except Exception as e:
+            self._messages.put(("error", context.name, e))
+        else:
+            self._messages.put(("done", context.name, result))
+
+    def _poll(self):
+        while True:
+            try:
+                kind, name, payload = self._messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                if self.on_progress is not None and name in self._tasks:
+                    self.on_progress(name, *payload)
+                continue
+
+            _, on_done, on_error, on_cancelled = self._tasks.pop(name)
+            if kind == "done" and on_done is not None:
+                on_done(payload)
+            elif kind == "error" and on_error is not None:
+                on_error(payload)
+            elif kind == "cancelled" and on_cancelled is not None:
+                on_cancelled()
+        self.root.after(self.poll_interval_ms, self._poll)
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from spatial_index import SpatialIndex, haversine_km
+
+# The grid index is checked against a plain haversine scan over every transmitter.
+
+multiplexes = ['C18A', 'C18F', 'C188']
+
+@pytest.fixture(scope="module")
+def sites():
+    rng = np.random.default_rng(7)
+    count = 3000
+    df = pd.DataFrame({
+        'id': np.arange(count),
+        'Lat': rng.uniform(49.9, 58.7, count),
+        'Long': rng.uniform(-7.5, 1.8, count),
+        'Multiplex': rng.choice(multiplexes + [None], count),
+    })
+    # A few rows without coordinates, which the index leaves out
+    df.loc[::97, 'Lat'] = np.nan
+    return df
+
+@pytest.fixture(scope="module")
+def queries():
+    rng = np.random.default_rng(11)
+    return rng.uniform(50.0, 58.5, 40), rng.uniform(-7.0, 1.5, 40)
+
+def brute_force(sites, lat, lon, wanted):
+    located = sites.dropna(subset=['Lat', 'Long'])
+    if wanted is not None:
+        located = located[located['Multiplex'].isin(wanted)]
+    distances = haversine_km(lat, lon, located['Lat'].to_numpy(), located['Long'].to_numpy())
+    order = np.argsort(distances, kind='stable')
+    return located['id'].to_numpy()[order], distances[order]
+
+@pytest.mark.parametrize("wanted", [None, ['C18A'], ['C18F', 'C188']])
+@pytest.mark.parametrize("radius_km", [5.0, 30.0, 250.0])
+def test_within_radius_matches_brute_force(sites, queries, wanted, radius_km):
+    index = SpatialIndex(sites, cell_km=10.0)
+    batch = index.within_radius_batch(*queries, radius_km, multiplexes=wanted)
+    for position, (lat, lon) in enumerate(zip(*queries)):
+        ids, distances = brute_force(sites, lat, lon, wanted)
+        expected = set(ids[distances <= radius_km])
+        single = index.within_radius(lat, lon, radius_km, multiplexes=wanted)
+        assert set(single['id']) == expected
+        assert set(batch.loc[batch['query'] == position, 'id']) == expected
+        assert single['distance_km'].is_monotonic_increasing
+
+@pytest.mark.parametrize("wanted", [None, ['C18A'], ['C18F', 'C188']])
+@pytest.mark.parametrize("k", [1, 5, 40])
+def test_nearest_matches_brute_force(sites, queries, wanted, k):
+    index = SpatialIndex(sites, cell_km=10.0)
+    batch = index.nearest_batch(*queries, k, multiplexes=wanted)
+    for position, (lat, lon) in enumerate(zip(*queries)):
+        ids, distances = brute_force(sites, lat, lon, wanted)
+        single = index.nearest(lat, lon, k, multiplexes=wanted)
+        answer = batch[batch['query'] == position]
+        for result in (single, answer):
+            assert list(result['id']) == list(ids[:k])
+            np.testing.assert_allclose(result['distance_km'], distances[:k])
+
+def test_nearest_returns_everything_when_k_is_more_than_the_sites(sites):
+    index = SpatialIndex(sites.head(20), cell_km=10.0)
+    result = index.nearest(54.0, -2.0, k=100)
+    assert len(result) == sites.head(20)['Lat'].notna().sum()
+
+def test_rejects_tiny_cells(sites):
+    with pytest.raises(ValueError):
+        SpatialIndex(sites, cell_km=0.0)
@@ -0,0 +1,50 @@
+import json
+import os
+import pandas as pd
+import pytest
+from data_processing import (clean_data, stream_clean_data, merge_sorted_chunks, read_csv_chunks, document_hash)
+
+# The streaming ingest, run with chunks much smaller than the files, has to give the same
+# rows and the same stored documents as cleaning the whole files at once.
+
+here = os.path.dirname(os.path.abspath(__file__))
+file_path = {"Antenna": os.path.join(here, "TxAntennaDAB.csv"), "Params": os.path.join(here, "TxParamsDAB.csv")}
+chunksize = 97
+
+@pytest.fixture(scope="module")
+def cleaned(tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp("clean")
+    return clean_data(file_path, output_path=str(work_dir / "merged_data.arrow"), use_mongo=False, report_path=None)
+
+@pytest.fixture(scope="module")
+def streamed(tmp_path_factory):
+    json_path = tmp_path_factory.mktemp("stream") / "merged_data.json"
+    chunks = list(stream_clean_data(file_path, chunksize, json_path=str(json_path), use_mongo=False))
+    return chunks, json_path
+
+def test_sorted_merge_matches_full_outer_merge():
+    antenna = pd.read_csv(file_path["Antenna"], nrows=0)
+    params = pd.read_csv(file_path["Params"], nrows=0, encoding='latin1')
+    merged = pd.concat(list(merge_sorted_chunks(read_csv_chunks(file_path["Antenna"], chunksize),
+                                                read_csv_chunks(file_path["Params"], chunksize, encoding='latin1'),
+                                                antenna, params)), ignore_index=True)
+    expected = pd.merge(pd.read_csv(file_path["Antenna"]), pd.read_csv(file_path["Params"], encoding='latin1'),
+                        on='id', how='outer')
+    assert merged['id'].is_unique
+    assert sorted(merged['id']) == sorted(expected['id'])
+    assert list(merged.columns) == list(expected.columns)
+
+def test_streamed_chunks_match_clean_data(cleaned, streamed):
+    chunks, _ = streamed
+    assert len(chunks) > 1
+    expected = {document['id']: document for document in cleaned.to_dict('records')}
+    documents = [document for chunk in chunks for document in chunk.to_dict('records')]
+    assert len(documents) == len(expected)
+    for document in documents:
+        assert document_hash(document) == document_hash(expected[document['id']])
+
+def test_streamed_json_holds_every_row(cleaned, streamed):
+    _, json_path = streamed
+    with open(json_path) as file:
+        rows = json.load(file)
+    assert sorted(row['id'] for row in rows) == sorted(cleaned['id'])
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+# Whole-column parsing of the raw text fields clean_data derives its columns from. Every
+# parser works on the full column at once with vectorised string operations and returns the
+# parsed values together with a mask of the values it had to reject, so bad input is
+# reported in bulk at the end instead of turning up as scattered NaNs.
+
+# Ofcom writes ERP in watts with a dot between thousands and a decimal comma, so
+# "2.000,000" is 2000 W and "0.760,001" is 760.001 W. Values without a comma are taken to
+# be plain kW numbers, the way they come out of files that were already converted.
+ofcom_power_pattern = r'\d{1,3}(?:\.\d{3})*,\d+|\d+,\d+'
+plain_number_pattern = r'\d+(?:\.\d+)?'
+# dd/mm/yyyy
+date_format = '%d/%m/%Y'
+# An EID starts with the four hex digits of the multiplex id, e.g. C18A
+eid_pattern = r'[0-9A-Fa-f]{4}.*'
+
+# How many distinct rejected values are kept per column as examples
+rejected_examples = 5
+
+def _text(values):
+    return values.astype('str').str.strip().where(values.notna())
+
+# Power (kW) from the In-Use ERP Total text. The conversion from W is done by moving the
+# decimal point in the text rather than dividing, so "8.510,009" gives exactly the float
+# 8.510009, the same number the old comma-stripping produced for this format.
+def parse_power_kw(values):
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float), np.zeros(len(values), dtype=bool)
+    text = _text(values)
+    present = text.notna() & (text != '')
+    ofcom = present & text.str.fullmatch(ofcom_power_pattern).fillna(False).astype(bool)
+    plain = present & ~ofcom & text.str.fullmatch(plain_number_pattern).fillna(False).astype(bool)
+
+    # "8.510,009" -> "0008510,009" -> "0008.510009": the leading zeros make sure there are
+    # always three digits before the comma to move the point over
+    watts = '000' + text.where(ofcom).str.replace('.', '', regex=False)
+    kw_text = watts.str.replace(r'(\d{3}),', r'.\1', regex=True)
+    power = pd.to_numeric(kw_text.where(ofcom, text.where(plain)), errors='coerce')
+    return power.astype(float), (present & ~ofcom & ~plain).to_numpy()
+
+# Dates checked as real dd/mm/yyyy dates, so 31/02/2005 is rejected rather than read as 2005
+def parse_dates(values):
+    text = _text(values)
+    present = text.notna() & (text != '')
+    dates = pd.to_datetime(text.where(present), format=date_format, errors='coerce')
+    return dates, (present & dates.isna()).to_numpy()
+
+# Heights and other whole-number columns, which read_csv has usually parsed already
+def parse_numbers(values):
+    if pd.api.types.is_numeric_dtype(values):
+        return values, np.zeros(len(values), dtype=bool)
+    text = _text(values)
+    present = text.notna() & (text != '')
+    numbers = pd.to_numeric(text.where(present), errors='coerce')
+    return numbers, (present & numbers.isna()).to_numpy()
+
+# The multiplex (C18A, C18F, C188, ...) from the EID column
+def multiplex_from_eid(values):
+    text = _text(values)
+    present = text.notna() & (text != '')
+    valid = present & text.str.fullmatch(eid_pattern).fillna(False).astype(bool)
+    multiplex = text.str[:4].str.upper().where(valid)
+    return multiplex, (present & ~valid).to_numpy()
+
+# True/False for each multiplex in one comparison per column
+def indicator_columns(multiplex, multiplexes):
+    codes = multiplex.to_numpy(dtype=object)
+    return {name: codes == name for name in multiplexes}
+
+# Adds one column's rejected values to report: how many there were and a few examples
+def record_rejected(report, column, values, rejected):
+    if rejected.any():
+        bad = values[rejected]
+        report[column] = {"count": int(rejected.sum()),
+                          "examples": [str(value) for value in pd.unique(bad.to_numpy(dtype=object))[:rejected_examples]]}
+
+def merge_rejected(report, other):
+    for column, rejected in other.items():
+        if column in report:
+            report[column]["count"] += rejected["count"]
+            examples = report[column]["examples"]
+            examples.extend(value for value in rejected["examples"] if value not in examples)
+            del examples[rejected_examples:]
+        else:
+            report[column] = {"count": rejected["count"], "examples": list(rejected["examples"])}
+    return report
+
+def print_rejected_values(report):
+    for column, rejected in report.items():
+        print(f"Rejected {rejected['count']} value(s) in '{column}', e.g. {', '.join(rejected['examples'])}")
@@ -1,95 +1,94 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from pymongo import MongoClient
+from database import find_multiplex_documents
 from data_processing import multiplexes
+from service_index import service_index
 
 def visualize_multiplex_data():
-    # we need to connect to the database as we will be querying it for the multiplexes.
-    client = MongoClient("mongodb://localhost:27017/") 
-    db = client['dab_database']
-    collection = db['dab_data']
-    
-    # Query data for the relevant multiplexes: C18A, C18F, C188
-    query = {"Multiplex": {"$in": multiplexes}}
-    
+    # Plot the data
+    data_displayer(fetch_multiplex_data())
+
+# Just the database part of visualize_multiplex_data, so the GUI can run it on a worker
+# thread and then plot on the Tk thread
+def fetch_multiplex_data():
+    # we query the database for the relevant multiplexes: C18A, C18F, C188, the shared
+    # client in database.py keeps its connections warm between button presses.
     # Retrieve the necessary fields as per the client requirement.
-    fields = {
-        "Site": 1, 
-        "Freq": 1,
-        "Block": 1,
-        "Serv Label1": 1,
-        "Serv Label2": 1,
-        "Serv Label3": 1,
-        "Serv Label4": 1,
-        "Serv Label10": 1,
-        "Multiplex": 1
-    }
-    
-    data = collection.find(query, fields)
-    
-    # Convert MongoDB cursor to pandas DataFrame
-    df = pd.DataFrame(list(data))
+    # The params file pads the service label headers with a trailing space, and the
+    # documents keep the CSV headers as field names, so they are asked for padded and
+    # stripped once fetched.
+    fields = [
+        "id",
+        "Site",
+        "Freq",
+        "Block",
+        "Serv Label1 ",
+        "Serv Label2 ",
+        "Serv Label3 ",
+        "Serv Label4 ",
+        "Serv Label10 ",
+        "Multiplex"
+    ]
+    
+    # id and Freq are decoded straight into numeric columns, the rest as strings
+    df = find_multiplex_documents(multiplexes, fields, dtypes={"id": "int64", "Freq": "float64"})
+    df = df.rename(columns=str.strip)
     
     # Drop rows with missing multiplex or service labels to avoid errors.
     df.dropna(subset=["Multiplex"], inplace=True)
-    
-    # Plot the data
-    data_displayer(df)
+    return df
     
 def data_displayer(df):
     #We need to print a few graphs here, I am going to group the service labels but keep
     #the rest of them seperate.
+    for plot_figure in multiplex_figures.values():
+        plot_figure(df)
+        plt.show()
+
+# Each of the figures below is drawn on a new figure and returned rather than shown, so the
+# batch CLI can render them off-screen to files as well as data_displayer showing them.
 
-    # 1. Number of Sites per Multiplex - Bar Plot
-    multiplex_site_count = df.groupby('Multiplex')['Site'].nunique()  # Count unique sites for each multiplex
+# 1. Number of Sites per Multiplex - Bar Plot
+def plot_sites_per_multiplex(df):
+    multiplex_site_count = df.groupby('Multiplex', observed=True)['Site'].nunique()  # Count unique sites for each multiplex
     plt.figure(figsize=(8, 6))
     multiplex_site_count.plot(kind='bar', color='red')
     plt.title('Number of Sites per Multiplex')
     plt.xlabel('Multiplex')
     plt.ylabel('Unique Site Count')
     plt.xticks(rotation=0)
-    plt.show()
+    return plt.gcf()
     
-    # 2. Frequency per Multiplex - Bar Plot
-    multiplex_freq = df.groupby('Multiplex')['Freq'].first()  # Assuming the frequency is the same per multiplex
+# 2. Frequency per Multiplex - Bar Plot
+def plot_frequency_per_multiplex(df):
+    multiplex_freq = df.groupby('Multiplex', observed=True)['Freq'].first()  # Assuming the frequency is the same per multiplex
+    plt.figure()
     multiplex_freq.plot(kind='bar', color='blue')
     plt.title('Frequency per Multiplex')
     plt.xlabel('Multiplex')
     plt.ylabel('Frequency (MHz)')
     plt.xticks(rotation=0)
-    plt.show()
+    return plt.gcf()
     
-    # 3. Number of Blocks per Multiplex - Bar Plot - There are no unique Blocks it is always
-    # "12B"
-    multiplex_block_count = df.groupby('Multiplex')['Block'].nunique()  # Count unique blocks for each multiplex
+# 3. Number of Blocks per Multiplex - Bar Plot - There are no unique Blocks it is always
+# "12B"
+def plot_blocks_per_multiplex(df):
+    multiplex_block_count = df.groupby('Multiplex', observed=True)['Block'].nunique()  # Count unique blocks for each multiplex
     plt.figure(figsize=(8, 6))
     multiplex_block_count.plot(kind='bar', color='orange')
     plt.title('Number of Blocks per Multiplex')
     plt.xlabel('Multiplex')
     plt.ylabel('Unique Block Count')
     plt.xticks(rotation=0)
-    plt.show()
-
-    # 4. Service Label Distribution across Multiplexes - Stacked Bar Plot
-    # Prepare a dictionary to store the count of each service label per multiplex
-    #as I am going to be plotting the counts
-    service_labels = ['Serv Label1', 'Serv Label2', 'Serv Label3', 'Serv Label4', 'Serv Label10']
+    return plt.gcf()
 
-    # Prepare a dictionary to store the count of each service label per multiplex
-    service_label_counts = {label: [] for label in service_labels}
-
-    # For each multiplex, count how many of each service label appear
-    for multiplex in multiplexes:
-        multiplex_data = df[df['Multiplex'] == multiplex]
-        for label in service_labels:
-            # Count occurrences of each service label in the multiplex
-            # Count non-null values for each label, i am not counting null values to avoid errors.
-            label_count = multiplex_data[label].notna().sum()  
-            service_label_counts[label].append(label_count)
-    
-    # Convert the counts dictionary to a DataFrame so I can pot without errors.
-    service_label_counts_df = pd.DataFrame(service_label_counts, index=multiplexes)
+# 4. Service Label Distribution across Multiplexes - Stacked Bar Plot
+def plot_service_label_distribution(df):
+    # Count how many transmitters of each multiplex have each of these service labels,
+    #straight from the service index rather than scanning the label columns
+    service_slots = [1, 2, 3, 4, 10]
+    service_labels = [f'Serv Label{slot}' for slot in service_slots]
+    service_label_counts_df = service_index(df).slot_counts(multiplexes, service_slots)
     
      # Get a color palette with the same number of colors as there are service labels
     colors = sns.color_palette("Set2", n_colors=len(service_labels))
@@ -112,4 +111,12 @@ def data_displayer(df):
     # Ensure the layout is tight for better display
     plt.tight_layout() 
     
-    plt.show()
\ No newline at end of file
+    return plt.gcf()
+
+# Every multiplex figure by name, in the order data_displayer shows them
+multiplex_figures = {
+    "sites_per_multiplex": plot_sites_per_multiplex,
+    "frequency_per_multiplex": plot_frequency_per_multiplex,
+    "blocks_per_multiplex": plot_blocks_per_multiplex,
+    "service_label_distribution": plot_service_label_distribution,
+}